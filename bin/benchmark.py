@@ -0,0 +1,173 @@
+"""Build performance benchmarks for imvujs, driven by third-party/scons-time.py.
+
+usage:
+    benchmark.py run [-o results.json] [-j N]
+    benchmark.py compare baseline.json current.json [--threshold 0.10]
+
+`run` copies the working tree to a scratch directory, the same way
+`scons-time run` does, and runs each scenario there with scons-time's
+debug flags.  `compare` exits non-zero if any metric regressed by more
+than the threshold.
+"""
+
+import imp
+import json
+import multiprocessing
+import optparse
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SCONS = os.path.join(ROOT, 'third-party', 'scons.py')
+
+scons_time = imp.load_source(
+    'scons_time', os.path.join(ROOT, 'third-party', 'scons-time.py'))
+
+# Not copied into the scratch tree: build state would make the cold build
+# warm, and the VCS metadata is large and irrelevant.
+IGNORED = ['.git', 'out', '.sconsign.dblite', '.sconsgraph.json', '*.pyc']
+
+LEAF_MODULE = 'fakes/FakeRandom.js'
+SHARED_MODULE = 'src/module-common.js'
+
+# Metrics compared by `compare`.  Higher is worse for all of them.
+METRICS = ['wall', 'cpu', 'peak_rss_kb', 'subprocesses']
+
+def clean(tree):
+    shutil.rmtree(os.path.join(tree, 'out'), ignore_errors=True)
+    sconsign = os.path.join(tree, '.sconsign.dblite')
+    if os.path.exists(sconsign):
+        os.remove(sconsign)
+
+def edit(path):
+    # SCons compares content signatures, so touching the timestamp is not
+    # enough to trigger a rebuild.
+    with open(path, 'ab') as f:
+        f.write('\n// benchmark edit %f\n' % time.time())
+
+# Each scenario is (name, prepare(tree), extra scons flags).  They run in
+# order in the same scratch tree, so each one starts from the state the
+# previous one left behind.
+def scenarios(jobs):
+    return [
+        ('cold', clean, []),
+        ('null', None, []),
+        ('touch-leaf', lambda tree: edit(os.path.join(tree, LEAF_MODULE)), []),
+        ('touch-module-common', lambda tree: edit(os.path.join(tree, SHARED_MODULE)), []),
+        ('cold-j1', clean, ['-j1']),
+        ('cold-j%d' % jobs, clean, ['-j%d' % jobs]),
+    ]
+
+def run_scons(tree, flags, log):
+    timer = scons_time.SConsTimer()
+    command = [sys.executable, SCONS, '-C', tree, '-Q'] + timer.scons_flags.split() + flags
+
+    start = time.time()
+    with open(log, 'wb') as output:
+        popen = subprocess.Popen(command, stdout=output, stderr=subprocess.STDOUT)
+        # wait4 gives us the resource usage of this build alone, including
+        # the Java and Node processes it waited for.
+        _, status, rusage = os.wait4(popen.pid, 0)
+    wall = time.time() - start
+
+    # WEXITSTATUS is 0 for a build killed by a signal, so check that first.
+    if os.WIFSIGNALED(status):
+        raise RuntimeError('scons killed by signal %d, see %s' % (os.WTERMSIG(status), log))
+    if os.WEXITSTATUS(status):
+        raise RuntimeError('scons failed, see %s' % (log,))
+
+    contents = open(log).read()
+    times = dict(zip(
+        ['total', 'sconscripts', 'scons', 'commands'],
+        timer.get_debug_times(log) or []))
+    return {
+        'wall': wall,
+        'cpu': rusage.ru_utime + rusage.ru_stime,
+        'peak_rss_kb': rusage.ru_maxrss,
+        'subprocesses': contents.count('Command execution time:'),
+        'scons_memory': timer.get_memory(log),
+        'scons_times': times,
+    }
+
+def do_run(argv):
+    parser = optparse.OptionParser(usage='benchmark.py run [options]')
+    parser.add_option('-o', '--output', default='benchmark.json')
+    parser.add_option('-j', '--jobs', type='int', default=multiprocessing.cpu_count())
+    parser.add_option('--keep', action='store_true', help="don't delete the scratch tree")
+    options, args = parser.parse_args(argv)
+
+    scratch = tempfile.mkdtemp(prefix='imvujs-benchmark-')
+    tree = os.path.join(scratch, 'imvujs')
+    try:
+        print 'copying tree to', tree
+        shutil.copytree(ROOT, tree, ignore=shutil.ignore_patterns(*IGNORED))
+        subprocess.check_call([sys.executable, SCONS, '-C', os.path.join(tree, 'bin'), '-Q'])
+
+        results = {}
+        for name, prepare, flags in scenarios(options.jobs):
+            if prepare is not None:
+                prepare(tree)
+            print 'running %s ...' % (name,),
+            sys.stdout.flush()
+            result = run_scons(tree, flags, os.path.join(scratch, name + '.log'))
+            print '%.2fs' % (result['wall'],)
+            results[name] = result
+    finally:
+        if not options.keep:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    json.dump({
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'cpu_count': multiprocessing.cpu_count(),
+        'time': time.time(),
+        'scenarios': results,
+    }, open(options.output, 'wb'), indent=2, sort_keys=True)
+    print 'wrote', options.output
+    return 0
+
+def do_compare(argv):
+    parser = optparse.OptionParser(usage='benchmark.py compare baseline.json current.json [options]')
+    parser.add_option('--threshold', type='float', default=0.10,
+                      help='allowed relative slowdown before flagging (default 0.10)')
+    options, args = parser.parse_args(argv)
+    if len(args) != 2:
+        parser.error('expected two result files')
+
+    baseline, current = [json.load(open(path))['scenarios'] for path in args]
+
+    regressions = 0
+    print '%-22s %-14s %12s %12s %8s' % ('scenario', 'metric', 'baseline', 'current', 'change')
+    for name in sorted(set(baseline) & set(current)):
+        for metric in METRICS:
+            before = baseline[name][metric]
+            after = current[name][metric]
+            change = (after - before) / float(before) if before else 0.0
+            flag = ''
+            if change > options.threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            print '%-22s %-14s %12.3f %12.3f %+7.1f%%%s' % (name, metric, before, after, change * 100, flag)
+
+    if regressions:
+        print '%d regression(s) past %.0f%%' % (regressions, options.threshold * 100)
+        return 1
+    return 0
+
+def main(argv):
+    commands = {
+        'run': do_run,
+        'compare': do_compare,
+    }
+    if len(argv) < 2 or argv[1] not in commands:
+        print __doc__
+        return 1
+    return commands[argv[1]](argv[2:])
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
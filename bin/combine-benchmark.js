@@ -0,0 +1,162 @@
+/*global console*/
+
+// Times combine's module graph traversal on synthetic module graphs.
+//
+// usage:
+//     s/node bin/combine-benchmark.js [--sizes 1000,10000,50000] [--shapes deep,wide,layered] [--jobs N]
+//
+// Shapes:
+//     deep     each module imports the next one: one long chain
+//     wide     the root imports every other module directly
+//     layered  each module imports up to three later modules, so most
+//              modules are reached along many paths
+//
+// The modules are written to a temporary directory, so readModules pays
+// for parsing as it would in a real build.  Per-module times that grow
+// with the graph size mean something is no longer linear.  With --jobs,
+// files are parsed by readModulesParallel in that many worker processes.
+
+var fs      = require('fs');
+var os      = require('os');
+var path    = require('path');
+var combine = require('./combine.js');
+
+var SHAPES = {
+    deep: function (i, count) {
+        return i + 1 < count ? [i + 1] : [];
+    },
+    wide: function (i, count) {
+        if (i !== 0) {
+            return [];
+        }
+        var deps = [];
+        for (var j = 1; j < count; ++j) {
+            deps.push(j);
+        }
+        return deps;
+    },
+    layered: function (i, count) {
+        var deps = [];
+        for (var j = 1; j <= 3; ++j) {
+            var k = i * 3 + j;
+            if (k < count) {
+                deps.push(k);
+            }
+        }
+        // and one more edge to a module some other module imports too
+        if (i > 0 && i * 2 < count) {
+            deps.push(i * 2);
+        }
+        return deps;
+    }
+};
+
+function moduleName(i) {
+    return 'm' + i + '.js';
+}
+
+function writeGraph(directory, shape, count) {
+    for (var i = 0; i < count; ++i) {
+        var deps = SHAPES[shape](i, count).map(function (j) {
+            return '    m' + j + ": './" + moduleName(j) + "'";
+        });
+        fs.writeFileSync(
+            path.join(directory, moduleName(i)),
+            'module({\n' + deps.join(',\n') + '\n}, function(imports) {\n    return ' + i + ';\n});\n');
+    }
+}
+
+function removeGraph(directory) {
+    fs.readdirSync(directory).forEach(function (name) {
+        fs.unlinkSync(path.join(directory, name));
+    });
+    fs.rmdirSync(directory);
+}
+
+function time(f, callback) {
+    var start = process.hrtime();
+    f(function (error, result) {
+        if (error) {
+            throw error;
+        }
+        var elapsed = process.hrtime(start);
+        callback({
+            result: result,
+            ms: elapsed[0] * 1e3 + elapsed[1] / 1e6
+        });
+    });
+}
+
+function pad(s, width) {
+    s = String(s);
+    while (s.length < width) {
+        s = ' ' + s;
+    }
+    return s;
+}
+
+function run(shape, count, jobs, callback) {
+    var directory = fs.mkdtempSync(path.join(os.tmpdir(), 'combine-benchmark-'));
+    writeGraph(directory, shape, count);
+    var root = path.join(directory, moduleName(0));
+    time(function (done) {
+        if (jobs > 1) {
+            combine.readModulesParallel(root, jobs, done);
+        } else {
+            done(null, combine.readModules(root));
+        }
+    }, function (read) {
+        time(function (done) {
+            done(null, combine.emitModules(root, read.result));
+        }, function (emit) {
+            removeGraph(directory);
+            console.log(
+                pad(shape, 8) + pad(count, 8) +
+                pad(read.ms.toFixed(0), 10) + pad((read.ms * 1e3 / count).toFixed(1), 10) +
+                pad(emit.ms.toFixed(0), 10) + pad((emit.ms * 1e3 / count).toFixed(1), 10));
+            callback();
+        });
+    });
+}
+
+function main(argv) {
+    var sizes = [1000, 10000, 50000];
+    var shapes = Object.keys(SHAPES);
+    var jobs = 1;
+    for (var i = 0; i < argv.length; ++i) {
+        if (argv[i] === '--sizes') {
+            sizes = argv[++i].split(',').map(Number);
+        } else if (argv[i] === '--shapes') {
+            shapes = argv[++i].split(',');
+        } else if (argv[i] === '--jobs') {
+            jobs = argv[++i] === 'auto' ? os.cpus().length : parseInt(argv[i], 10);
+        } else {
+            console.error('usage: combine-benchmark.js [--sizes N,N,...] [--shapes deep,wide,layered] [--jobs N|auto]');
+            process.exit(1);
+        }
+    }
+    shapes.forEach(function (shape) {
+        if (!SHAPES.hasOwnProperty(shape)) {
+            throw new Error('Unknown shape: ' + shape);
+        }
+    });
+
+    var runs = [];
+    shapes.forEach(function (shape) {
+        sizes.forEach(function (count) {
+            runs.push([shape, count]);
+        });
+    });
+
+    console.log(
+        pad('shape', 8) + pad('modules', 8) +
+        pad('read ms', 10) + pad('us/mod', 10) +
+        pad('emit ms', 10) + pad('us/mod', 10));
+    (function next(i) {
+        if (i < runs.length) {
+            run(runs[i][0], runs[i][1], jobs, next.bind(null, i + 1));
+        }
+    })(0);
+}
+
+main(process.argv.slice(2));
@@ -1,4 +1,4 @@
-/* global console: true */
+/* global console: true, __filename: false, Buffer: false */
 /* global -_ */
 
 ///<reference path="../third-party/DefinitelyTyped/node/node.d.ts"/>
@@ -12,6 +12,9 @@ import uglify = require('uglify-js');
 import _            = require('underscore');
 import fs           = require('fs');
 import path         = require('path');
+import child_process = require('child_process');
+import os           = require('os');
+import zlib         = require('zlib');
 
 interface UnresolvedModule {
     referrer: string;
@@ -46,6 +49,11 @@ export interface ReadModulesResult {
 
 var globalAliases: DependencyMap = {};
 
+// Resolves @name dependencies to path, like --alias name=path.
+export function setAlias(name: string, path: string): void {
+    globalAliases[name] = path;
+}
+
 function matchModuleCall(path: string, anyNode: uglify.AST_Node): ModuleInfo {
     if (!(anyNode instanceof uglify.AST_Call)) {
         return null;
@@ -116,20 +124,37 @@ function matchModuleCall(path: string, anyNode: uglify.AST_Node): ModuleInfo {
     }
 }
 
-export function loadModule(filename: string): ModuleInfo {
+function parseFile(filename: string): uglify.AST_Toplevel {
     var code = fs.readFileSync(filename, 'utf8');
+    return uglify.parse(code, {
+        filename: filename
+    });
+}
+
+function reportParseError(filename: string, e: any): void {
+    errorExit("Error in", filename, ": '" + e.message + "' at line:", e.line, "col:", e.col, "pos:", e.pos);
+}
+
+export function loadModule(filename: string): ModuleInfo {
     var ast: uglify.AST_Toplevel;
     try {
-        ast = uglify.parse(code, {
-            filename: filename
-        });
+        ast = parseFile(filename);
     } catch (e) {
-        errorExit("Error in", filename, ": '" + e.message + "' at line:", e.line, "col:", e.col, "pos:", e.pos);
+        reportParseError(filename, e);
     }
 
     return readModule(filename, ast);
 }
 
+// Returns the module in filename, or undefined if there is no such file.
+export interface ModuleLoader {
+    (filename: string): ModuleInfo;
+}
+
+function loadModuleIfExists(filename: string): ModuleInfo {
+    return fs.existsSync(filename) ? loadModule(filename) : undefined;
+}
+
 export function readModule(path: string, ast: uglify.AST_Toplevel): ModuleInfo {
     var result: ModuleInfo = null;
     ast.walk(new uglify.TreeWalker(function(node : uglify.AST_Node) {
@@ -232,34 +257,53 @@ export function errorExit(...args: any[]): void {
     process.exit(1);
 }
 
-export function readModules(root: string): ReadModulesResult {
+export function resolveDependency(dep: string, referrer: string): string {
+    // TODO: put this in some common part of the code?
+    // There may be duplication between this code, the node.js module loader, and the web module loader.
+    if (dep[0] === '@') {
+        dep = globalAliases[dep.substr(1)] || dep;
+    } else if (dep.indexOf('!') !== -1) {
+        var actionArgs: string[] = dep.split('!');
+        actionArgs[1] = '/' + combine_util.toAbsoluteUrl(actionArgs[1], referrer);
+        dep = actionArgs.join('!');
+    } else {
+        dep = combine_util.toAbsoluteUrl(dep, referrer);
+    }
+    return path.normalize(dep);
+}
+
+export function readModules(root: string, load?: ModuleLoader): ReadModulesResult {
+    return readAllModules([root], load);
+}
+
+// Reads the modules of several roots into one registry.
+export function readAllModules(roots: string[], load?: ModuleLoader): ReadModulesResult {
+    load = load || loadModuleIfExists;
     var registry: ModuleRegistry = {};
-    var remaining: UnresolvedModule[] = [
-        {
+    // A FIFO queue; head moves forward instead of shift()ing, which is
+    // linear in the queue length.
+    var queue: UnresolvedModule[] = _.map(roots, function (root: string): UnresolvedModule {
+        return {
             referrer: '<root>',
             filename: root
-        }
-    ];
+        };
+    });
+    var head = 0;
     var missing: MissingModules = {};
     var aliases: string[] = [];
     var customActions: string[] = [];
 
-    while (remaining.length) {
-        var item = remaining.shift();
+    while (head < queue.length) {
+        var item = queue[head++];
         var referrer = item.referrer;
         var filename = item.filename;
 
         if (!registry.hasOwnProperty(filename)) {
-            var module: ModuleInfo;
-            if (fs.existsSync(filename)) {
-                module = loadModule(filename);
-                if (module === null) {
-                    throw "ES5: Invalid module " + filename;
-                }
-                if (module === undefined) {
-                    throw 'ES5: Invalid module (undefined)?!?!? ' + filename;
-                }
-            } else {
+            var module = load(filename);
+            if (module === null) {
+                throw "ES5: Invalid module " + filename;
+            }
+            if (module === undefined) {
                 if (filename[0] === '@') {
                     aliases.push(filename);
                 } else if (filename.indexOf('!') !== -1) {
@@ -281,29 +325,15 @@ export function readModules(root: string): ReadModulesResult {
 
             var deps = module.deps;
             for (var k in deps) {
-                var dep = deps[k];
-                // TODO: put this in some common part of the code?
-                // There may be duplication between this code, the node.js module loader, and the web module loader.
-                if (dep[0] === '@') {
-                    dep = globalAliases[dep.substr(1)] || dep;
-                } else if (dep.indexOf('!') !== -1) {
-                    var actionArgs: string[] = dep.split('!');
-                    actionArgs[1] = '/' + combine_util.toAbsoluteUrl(actionArgs[1], filename);
-                    dep = actionArgs.join('!');
-                } else {
-                    dep = combine_util.toAbsoluteUrl(dep, filename);
-                }
-                deps[k] = path.normalize(dep);
-            }
-
-            remaining = remaining.concat(
-                _.map(deps, function (dep, i): UnresolvedModule {
-                    return {
+                var dep = resolveDependency(deps[k], filename);
+                deps[k] = dep;
+                if (!registry.hasOwnProperty(dep)) {
+                    queue.push({
                         referrer: filename,
                         filename: dep
-                    };
-                })
-            );
+                    });
+                }
+            }
         }
     }
 
@@ -315,6 +345,225 @@ export function readModules(root: string): ReadModulesResult {
     };
 }
 
+// Module bodies cross between processes as JSON.  Tokens are dropped:
+// combine never prints comments or source maps, which are all they're for.
+function serializeAST(value: any): any {
+    if (value === null || typeof value !== 'object') {
+        return value;
+    }
+    if (Array.isArray(value)) {
+        return value.map(serializeAST);
+    }
+    if (value instanceof uglify.AST_Token) {
+        return undefined;
+    }
+    if (value instanceof uglify.AST_Node) {
+        var result: any = { $: value.TYPE };
+        _.each(value.CTOR.PROPS, function (name: string): void {
+            if (value[name] !== undefined && !(value[name] instanceof uglify.AST_Token)) {
+                result[name] = serializeAST(value[name]);
+            }
+        });
+        return result;
+    }
+    // uglify runs in its own context, so its RegExps aren't instanceof ours.
+    if (Object.prototype.toString.call(value) === '[object RegExp]') {
+        return { $regexp: value.source, flags: value.flags };
+    }
+    throw new Error('ES5: Cannot serialize ' + Object.prototype.toString.call(value));
+}
+
+function deserializeAST(value: any): any {
+    if (value === null || typeof value !== 'object') {
+        return value;
+    }
+    if (Array.isArray(value)) {
+        return value.map(deserializeAST);
+    }
+    if (value.$regexp !== undefined) {
+        return new RegExp(value.$regexp, value.flags);
+    }
+    var props: any = {};
+    for (var name in value) {
+        if (name !== '$') {
+            props[name] = deserializeAST(value[name]);
+        }
+    }
+    return new (<any>uglify)['AST_' + value.$](props);
+}
+
+interface WorkerRequest {
+    filename: string;
+}
+
+interface WorkerResponse {
+    filename: string;
+    deps?: DependencyMap;
+    body?: any;
+    parseError?: {
+        message: string;
+        line: number;
+        col: number;
+        pos: number;
+    };
+    error?: {
+        name: string;
+        message: string;
+    };
+}
+
+// Parses the files the parent asks for.  Each file's dependencies are
+// sent as soon as it's parsed, so the parent can hand them to other
+// workers while this one serializes the body.
+function runWorker(): void {
+    var parent: any = process;
+    parent.on('disconnect', function (): void {
+        process.exit(0);
+    });
+    parent.on('message', function (request: WorkerRequest): void {
+        var filename = request.filename;
+        var ast: uglify.AST_Toplevel;
+        try {
+            ast = parseFile(filename);
+        } catch (e) {
+            parent.send({
+                filename: filename,
+                parseError: { message: e.message, line: e.line, col: e.col, pos: e.pos }
+            });
+            return;
+        }
+
+        var module: ModuleInfo;
+        try {
+            module = readModule(filename, ast);
+        } catch (e) {
+            parent.send({
+                filename: filename,
+                error: { name: e.name, message: e.message === undefined ? String(e) : e.message }
+            });
+            return;
+        }
+
+        parent.send({ filename: filename, deps: module.deps });
+        parent.send({ filename: filename, body: serializeAST(module.body) });
+    });
+}
+
+// Reads the same module graph as readModules, parsing files in up to
+// `jobs` worker processes.  Once every reachable file is parsed, the
+// graph is walked again in memory, so the result, and which error is
+// reported if several files are bad, match readModules exactly.
+export function readModulesParallel(root: string, jobs: number, callback: (error: any, result?: ReadModulesResult) => void): void {
+    readAllModulesParallel([root], jobs, callback);
+}
+
+export function readAllModulesParallel(roots: string[], jobs: number, callback: (error: any, result?: ReadModulesResult) => void): void {
+    var workers: any[] = [];
+    var outstanding: number[] = [];
+    var requested: { [filename: string]: boolean } = {};
+    var deps: { [filename: string]: DependencyMap } = {};
+    var responses: { [filename: string]: WorkerResponse } = {};
+    var pending = 0;
+    var finished = false;
+
+    function finish(error: any, result?: ReadModulesResult) {
+        if (finished) {
+            return;
+        }
+        finished = true;
+        _.each(workers, function (worker: any): void {
+            worker.kill();
+        });
+        callback(error, result);
+    }
+
+    function spawn(): number {
+        var index = workers.length;
+        var worker = child_process.fork(__filename, ['--worker']);
+        worker.on('message', function (response: WorkerResponse): void {
+            var filename = response.filename;
+            if (response.deps) {
+                deps[filename] = response.deps;
+                _.each(response.deps, function (dep: string): void {
+                    request(resolveDependency(dep, filename));
+                });
+                return;
+            }
+            responses[filename] = response;
+            --outstanding[index];
+            if (--pending === 0) {
+                replay();
+            }
+        });
+        worker.on('exit', function (code: number): void {
+            finish(new Error('ES5: combine worker exited with code ' + code));
+        });
+        workers.push(worker);
+        outstanding.push(0);
+        return index;
+    }
+
+    // The least busy worker, or a new one if they're all busy.
+    function pickWorker(): number {
+        var best = -1;
+        for (var i = 0; i < workers.length; ++i) {
+            if (best === -1 || outstanding[i] < outstanding[best]) {
+                best = i;
+            }
+        }
+        if ((best === -1 || outstanding[best] > 0) && workers.length < jobs) {
+            best = spawn();
+        }
+        return best;
+    }
+
+    // Aliases, custom actions and missing files are readModules' business.
+    function request(filename: string) {
+        if (requested.hasOwnProperty(filename) || !fs.existsSync(filename)) {
+            return;
+        }
+        requested[filename] = true;
+        var index = pickWorker();
+        ++outstanding[index];
+        ++pending;
+        workers[index].send({ filename: filename });
+    }
+
+    function load(filename: string): ModuleInfo {
+        if (!responses.hasOwnProperty(filename)) {
+            return undefined;
+        }
+        var response = responses[filename];
+        if (response.parseError) {
+            reportParseError(filename, response.parseError);
+        }
+        if (response.error) {
+            var message = response.error.message;
+            throw response.error.name === 'SyntaxError' ? new ScriptError(message) : new Error(message);
+        }
+        return {
+            deps: deps[filename],
+            body: deserializeAST(response.body)
+        };
+    }
+
+    function replay() {
+        var result: ReadModulesResult;
+        try {
+            result = readAllModules(roots, load);
+        } catch (e) {
+            finish(e);
+            return;
+        }
+        finish(null, result);
+    }
+
+    _.each(roots, request);
+    if (pending === 0) {
+        process.nextTick(replay);
+    }
+}
+
 function assertModuleReturns(name: string, module: ModuleInfo) {
     var statements = module.body.body;
     var last = statements[statements.length - 1];
@@ -323,103 +572,244 @@ function assertModuleReturns(name: string, module: ModuleInfo) {
     }
 }
 
-export function emitModules(rootPath: string, readModules: ReadModulesResult): uglify.AST_Statement[] {
-    var modules = readModules.resolved;
-    var missing = readModules.missing;
-    var deferredAliases = readModules.aliases;
-    var customActions = readModules.customActions;
-    var emitted: ModuleInfo[] = [];
-    var aliases: DependencyMap = {}; // path : alias
+interface EmitFrame {
+    path: string;
+    module: ModuleInfo;
+    depPaths: string[];
+    next: number;
+}
 
-    var body: uglify.AST_Statement[] = [];
+export interface PathSet {
+    [path: string]: boolean;
+}
+
+function pathSet(paths: string[]): PathSet {
+    var result: PathSet = {};
+    _.each(paths, function (path: string): void {
+        result[path] = true;
+    });
+    return result;
+}
+
+function subscript(name: string, key: string): uglify.AST_Sub {
+    return new uglify.AST_Sub({
+        expression: new uglify.AST_SymbolRef({
+            name: name
+        }),
+        property: new uglify.AST_String({
+            value: key
+        })
+    });
+}
+
+// Emits modules as `var $module$N = function (imports) {...}({...});`
+// statements, each one after the modules it imports.  Lazy emitters wrap
+// each module in $module$once, so it only runs once something uses it,
+// and refer to it as `$module$N()`.
+interface ModuleEmitter {
+    // the statements emitted so far, unless they went to an output function
+    body: uglify.AST_Statement[];
+    // deferred modules the emitted code refers to, in order
+    deferredUsed: string[];
+    importedUsed: boolean;
+    // Emits path, after anything it imports that isn't emitted yet.
+    emit(path: string): void;
+    // The variable holding an emitted module: its exports, or if lazy, a
+    // function returning them.
+    alias(path: string): string;
+    // An expression for the exports of path, which must already be
+    // emitted, deferred or imported.
+    reference(path: string): uglify.AST_Node;
+    // The imports object for a module with these dependencies.
+    dependenciesObject(deps: DependencyMap): uglify.AST_Object;
+    // Adds a statement after everything emitted so far.
+    add(statement: uglify.AST_Statement): void;
+}
+
+// Modules in `deferred` (aliases and custom actions) are read from
+// $module$deferred, and modules in `imported` from the shared chunk's
+// table, $module$chunk.  Given output, statements are passed to it as
+// they are emitted instead of collected in body.
+function createModuleEmitter(modules: ModuleRegistry, deferred: PathSet, imported: PathSet, lazy: boolean,
+                             output?: (statement: uglify.AST_Statement) => void): ModuleEmitter {
+    var aliases: DependencyMap = {}; // path : alias, once emitted
+    var inProgress: PathSet = {};
+    var deferredSeen: PathSet = {};
 
     var nextIndex = 1;
     function newAlias() {
         return '$module$' + nextIndex++;
     }
 
-    function transformDependenciesObject(deps: DependencyMap): uglify.AST_ObjectProperty[] {
-        var props: uglify.AST_ObjectProperty[] = [];
-        _.each(deps, function (depPath: string, depAlias) {
-            if ((depPath[0] === '@' && _(deferredAliases).contains(depPath)) || (depPath.indexOf('!') !== -1 && _(customActions).contains(depPath))) {
-                props.push(new uglify.AST_ObjectKeyVal({
-                    key: depAlias,
-                    value: new uglify.AST_Sub({
-                        expression: new uglify.AST_SymbolRef({
-                            name: "$module$deferred"
-                        }),
-                        property: new uglify.AST_String({
-                            value: depPath
-                        })
-                    })
-                }));
-            } else {
-                emitDependencies(depPath, modules[depPath]);
+    function isEmitted(path: string): boolean {
+        return aliases.hasOwnProperty(path) ||
+            deferred.hasOwnProperty(path) ||
+            imported.hasOwnProperty(path);
+    }
 
-                props.push(new uglify.AST_ObjectKeyVal({
-                    key: depAlias,
-                    value: new uglify.AST_SymbolRef({
-                        name: aliases[depPath]
-                    })
-                }));
+    function reference(path: string): uglify.AST_Node {
+        if (deferred.hasOwnProperty(path)) {
+            if (!deferredSeen.hasOwnProperty(path)) {
+                deferredSeen[path] = true;
+                emitter.deferredUsed.push(path);
             }
+            return subscript('$module$deferred', path);
+        }
+        if (imported.hasOwnProperty(path)) {
+            emitter.importedUsed = true;
+            return new uglify.AST_Call({
+                expression: subscript('$module$chunk', path),
+                args: []
+            });
+        }
+        var ref = new uglify.AST_SymbolRef({
+            name: aliases[path]
+        });
+        return lazy ? new uglify.AST_Call({ expression: ref, args: [] }) : ref;
+    }
+
+    function dependenciesObject(deps: DependencyMap): uglify.AST_Object {
+        var props: uglify.AST_ObjectProperty[] = [];
+        _.each(deps, function (depPath: string, depAlias: string): void {
+            props.push(new uglify.AST_ObjectKeyVal({
+                key: depAlias,
+                value: reference(depPath)
+            }));
+        });
+        return new uglify.AST_Object({
+            properties: props
         });
-        return props;
     }
 
-    function emitDependencies(path: string, module: ModuleInfo) {
-        if (emitted.indexOf(module) !== -1) {
+    function frame(path: string): EmitFrame {
+        var module = modules[path];
+        inProgress[path] = true;
+        return {
+            path: path,
+            module: module,
+            depPaths: _.values(module.deps),
+            next: 0
+        };
+    }
+
+    // Emits path's dependencies depth first, in declaration order, and
+    // then path itself, so every module is defined before its importers.
+    // Iterative, since import chains can be deeper than the call stack.
+    function emit(path: string): void {
+        if (isEmitted(path)) {
             return;
         }
 
-        var args = transformDependenciesObject(module.deps);
-        var alias = newAlias();
-        aliases[path] = alias;
+        var stack: EmitFrame[] = [frame(path)];
+        while (stack.length) {
+            var top = stack[stack.length - 1];
+            if (top.next < top.depPaths.length) {
+                var depPath = top.depPaths[top.next++];
+                if (isEmitted(depPath)) {
+                    continue;
+                }
+                if (inProgress.hasOwnProperty(depPath)) {
+                    throw new ScriptError("ES5: Circular dependency: " + _.pluck(stack, 'path').concat([depPath]).join(' -> '));
+                }
+                stack.push(frame(depPath));
+                continue;
+            }
+
+            stack.pop();
+            delete inProgress[top.path];
+
+            var args = dependenciesObject(top.module.deps);
+            var alias = newAlias();
+            aliases[top.path] = alias;
+
+            var value: uglify.AST_Node = new uglify.AST_Call({
+                expression: top.module.body,
+                args: [args]
+            });
+            if (lazy) {
+                value = new uglify.AST_Call({
+                    expression: new uglify.AST_SymbolRef({ name: '$module$once' }),
+                    args: [new uglify.AST_Function({
+                        argnames: [],
+                        body: [new uglify.AST_Return({ value: value })]
+                    })]
+                });
+            }
 
-        body.push(new uglify.AST_Var({
-            definitions: [
-                new uglify.AST_VarDef({
-                    name: new uglify.AST_SymbolVar({ name: alias }),
-                    value: new uglify.AST_Call({
-                        expression: module.body,
-                        args: [new uglify.AST_Object({
-                            properties: args
-                        })]
+            add(new uglify.AST_Var({
+                definitions: [
+                    new uglify.AST_VarDef({
+                        name: new uglify.AST_SymbolVar({ name: alias }),
+                        value: value
                     })
-                })
-            ]
-        }));
-        emitted.push(module);
+                ]
+            }));
+        }
     }
 
+    function add(statement: uglify.AST_Statement): void {
+        if (output) {
+            output(statement);
+        } else {
+            emitter.body.push(statement);
+        }
+    }
+
+    var emitter: ModuleEmitter = {
+        body: [],
+        deferredUsed: [],
+        importedUsed: false,
+        emit: emit,
+        alias: function (path: string): string {
+            return aliases[path];
+        },
+        reference: reference,
+        dependenciesObject: dependenciesObject,
+        add: add
+    };
+    return emitter;
+}
+
+function deferredPaths(readModules: ReadModulesResult): PathSet {
+    return pathSet(readModules.aliases.concat(readModules.customActions));
+}
+
+// The body of rootPath's bundle: everything it imports, and then its own
+// statements, with its "imports" argument promoted to a file-scoped local.
+function emitRoot(emitter: ModuleEmitter, rootPath: string, modules: ModuleRegistry): uglify.AST_Statement[] {
     var rootModule = modules[rootPath];
 
-    // Promote the root module's "imports" argument to be a file-scoped local and
-    // make the root module no longer declare any dependencies.
-    body.push(new uglify.AST_Var({
+    _.each(rootModule.deps, function (depPath: string): void {
+        emitter.emit(depPath);
+    });
+
+    emitter.add(new uglify.AST_Var({
         definitions: [
             new uglify.AST_VarDef({
                 name: new uglify.AST_Symbol({
                     name: 'imports'
                 }),
-                value: new uglify.AST_Object({
-                    properties: transformDependenciesObject(rootModule.deps)
-                })
+                value: emitter.dependenciesObject(rootModule.deps)
             })
         ]
     }));
-    body.push.apply(body, rootModule.body.body);
-    rootModule.body.argnames = [];
+    _.each(rootModule.body.body, emitter.add);
+    return emitter.body;
+}
+
+export function emitModules(rootPath: string, readModules: ReadModulesResult): uglify.AST_Statement[] {
+    var emitter = createModuleEmitter(readModules.resolved, deferredPaths(readModules), {}, false);
+    var body = emitRoot(emitter, rootPath, readModules.resolved);
+    // the root module no longer declares any dependencies
+    readModules.resolved[rootPath].body.argnames = [];
     return body;
 }
 
 export var ScriptError = SyntaxError;
 
-export function combine(readModules: ReadModulesResult, rootPath: string) {
+function checkModules(readModules: ReadModulesResult): void {
     var modules = readModules.resolved;
     var missing = readModules.missing;
-    var deferredAliases = readModules.aliases;
-    var customActions = readModules.customActions;
 
     if (Object.keys(missing).length) {
         var msg = 'ES5: ';
@@ -434,9 +824,12 @@ export function combine(readModules: ReadModulesResult, rootPath: string) {
             assertModuleReturns(name, module);
         }
     });
+}
 
+// module({dep: dep, ...}, function($module$deferred) { body })
+function wrapBundle(deferred: string[], body: uglify.AST_Statement[]): uglify.AST_Toplevel {
     var aliasArgs: uglify.AST_ObjectProperty[] = [];
-    _.each(deferredAliases, (alias) => {
+    _.each(deferred, (alias) => {
         aliasArgs.push(new uglify.AST_ObjectKeyVal({
             key: alias,
             value: new uglify.AST_String({
@@ -444,14 +837,6 @@ export function combine(readModules: ReadModulesResult, rootPath: string) {
             })
         }))
     });
-    _.each(customActions, (action) => {
-        aliasArgs.push(new uglify.AST_ObjectKeyVal({
-            key: action,
-            value: new uglify.AST_String({
-                value: action
-            })
-        }))
-    });
     return new uglify.AST_Toplevel({
         body: [
             new uglify.AST_SimpleStatement({
@@ -469,7 +854,7 @@ export function combine(readModules: ReadModulesResult, rootPath: string) {
                                     name: '$module$deferred'
                                 })
                             ],
-                            body: emitModules(rootPath, readModules)
+                            body: body
                         })
                     ]
                 })
@@ -478,6 +863,391 @@ export function combine(readModules: ReadModulesResult, rootPath: string) {
     });
 }
 
+export function combine(readModules: ReadModulesResult, rootPath: string) {
+    checkModules(readModules);
+    return wrapBundle(
+        readModules.aliases.concat(readModules.customActions),
+        emitModules(rootPath, readModules));
+}
+
+// Collects text and writes it to a file descriptor in large pieces.
+export interface OutputBuffer {
+    write(text: string): void;
+    // Writes whatever is buffered, and closes the file unless it's stdout.
+    close(): void;
+}
+
+// Opens filename for writing, or stdout if there isn't one.
+export function createOutputBuffer(filename?: string, bufferSize?: number): OutputBuffer {
+    var fd = filename ? fs.openSync(filename, 'w') : 1;
+    var limit = bufferSize || 65536;
+    var pieces: string[] = [];
+    var length = 0;
+
+    function flush(): void {
+        if (pieces.length) {
+            fs.writeSync(fd, pieces.join(''));
+            pieces = [];
+            length = 0;
+        }
+    }
+
+    return {
+        write: function (text: string): void {
+            pieces.push(text);
+            length += text.length;
+            if (length >= limit) {
+                flush();
+            }
+        },
+        close: function (): void {
+            flush();
+            if (fd !== 1) {
+                fs.closeSync(fd);
+            }
+        }
+    };
+}
+
+var BODY_MARKER = '$module$body';
+
+// Writes the same text as gen_code(combine(readModules, rootPath)), but
+// prints each module's statement as soon as it is emitted, so neither the
+// bundle's AST nor its text has to be held all at once.
+export function streamCombine(readModules: ReadModulesResult, rootPath: string, output: OutputBuffer): void {
+    checkModules(readModules);
+
+    // Print the wrapper around a placeholder statement and split it there.
+    var wrapper = gen_code(wrapBundle(readModules.aliases.concat(readModules.customActions), [
+        new uglify.AST_SimpleStatement({
+            body: new uglify.AST_SymbolRef({ name: BODY_MARKER })
+        })
+    ]), {beautify: true});
+    var marker = wrapper.indexOf(BODY_MARKER + ';');
+    var head = wrapper.slice(0, marker);
+    var tail = wrapper.slice(marker + BODY_MARKER.length + 1);
+    var indent = head.slice(head.lastIndexOf('\n') + 1);
+    var options: uglify.OutputStreamOptions = {beautify: true, indent_start: indent.length};
+
+    output.write(head);
+    var first = true;
+    var emitter = createModuleEmitter(
+        readModules.resolved, deferredPaths(readModules), {}, false,
+        function (statement: uglify.AST_Statement): void {
+            // uglify doesn't print these either
+            if (statement instanceof uglify.AST_EmptyStatement) {
+                return;
+            }
+            output.write((first ? '' : '\n' + indent) + gen_code(statement, options));
+            first = false;
+        });
+    emitRoot(emitter, rootPath, readModules.resolved);
+    output.write(tail + '\n');
+}
+
+export interface Bundle {
+    ast: uglify.AST_Toplevel;
+    // the modules whose code is in this bundle
+    modules: string[];
+}
+
+export interface Chunks {
+    shared: Bundle;
+    entries: Bundle[];
+    // what each entry would be on its own, for comparison
+    standalone: Bundle[];
+}
+
+// Every module root includes, itself first, in the order they're found.
+function reachableFrom(root: string, modules: ModuleRegistry, deferred: PathSet): string[] {
+    var result: string[] = [];
+    var seen: PathSet = {};
+    var stack = [root];
+    seen[root] = true;
+    while (stack.length) {
+        var path = stack.pop();
+        result.push(path);
+        var deps = _.values(modules[path].deps).reverse();
+        _.each(deps, function (dep: string): void {
+            if (!seen.hasOwnProperty(dep) && !deferred.hasOwnProperty(dep)) {
+                seen[dep] = true;
+                stack.push(dep);
+            }
+        });
+    }
+    return result;
+}
+
+// function $module$once(f) { ... }: f's result, computed on first call
+var ONCE = uglify.parse(
+    'function $module$once(f) {\n' +
+    '    var done = false, exports;\n' +
+    '    return function () {\n' +
+    '        if (!done) {\n' +
+    '            exports = f();\n' +
+    '            done = true;\n' +
+    '        }\n' +
+    '        return exports;\n' +
+    '    };\n' +
+    '}').body[0];
+
+// Splits the bundles for roots into one shared chunk, holding every module
+// at least minShared of the bundles would include, and an entry bundle per
+// root holding the rest.  Everything a shared module imports is shared
+// too, since each bundle that includes a module includes its imports.
+//
+// The shared chunk is a module exporting a table, keyed by path, of
+// functions that return its modules' exports.  A shared module runs the
+// first time a bundle uses it, so a bundle runs the same modules, in
+// nearly the same order, as it would on its own.  Entries import the
+// chunk under chunkUrls[i], its path relative to theirs, as
+// $module$chunk.  Aliases and custom actions stay deferred in whichever
+// bundle refers to them.
+export function combineChunks(readModules: ReadModulesResult, roots: string[], chunkUrls: string[], minShared: number): Chunks {
+    checkModules(readModules);
+
+    var modules = readModules.resolved;
+    var deferred = deferredPaths(readModules);
+
+    var counts: { [path: string]: number } = {};
+    var order: string[] = [];
+    var contents = _.map(roots, function (root: string): string[] {
+        var paths = reachableFrom(root, modules, deferred);
+        _.each(paths, function (path: string): void {
+            if (!counts.hasOwnProperty(path)) {
+                counts[path] = 0;
+                order.push(path);
+            }
+            ++counts[path];
+        });
+        return paths;
+    });
+
+    var sharedPaths = _.filter(order, function (path: string): boolean {
+        return counts[path] >= minShared;
+    });
+    var shared = pathSet(sharedPaths);
+
+    var chunkEmitter = createModuleEmitter(modules, deferred, {}, true);
+    _.each(sharedPaths, chunkEmitter.emit);
+    var chunkBody = [<uglify.AST_Statement>ONCE].concat(chunkEmitter.body);
+    chunkBody.push(new uglify.AST_Return({
+        value: new uglify.AST_Object({
+            properties: _.map(sharedPaths, function (path: string): uglify.AST_ObjectProperty {
+                return new uglify.AST_ObjectKeyVal({
+                    key: path,
+                    value: new uglify.AST_SymbolRef({
+                        name: chunkEmitter.alias(path)
+                    })
+                });
+            })
+        })
+    }));
+
+    var entries = _.map(roots, function (root: string, i: number): Bundle {
+        var emitter = createModuleEmitter(modules, deferred, shared, false);
+        var body: uglify.AST_Statement[];
+        if (shared.hasOwnProperty(root)) {
+            // Another root imports this one, so it's in the chunk already.
+            body = [new uglify.AST_Return({
+                value: emitter.reference(root)
+            })];
+        } else {
+            body = emitRoot(emitter, root, modules);
+        }
+
+        var deps = emitter.deferredUsed;
+        if (emitter.importedUsed) {
+            body.unshift(new uglify.AST_Var({
+                definitions: [
+                    new uglify.AST_VarDef({
+                        name: new uglify.AST_SymbolVar({ name: '$module$chunk' }),
+                        value: subscript('$module$deferred', chunkUrls[i])
+                    })
+                ]
+            }));
+            deps = [chunkUrls[i]].concat(deps);
+        }
+        return {
+            ast: wrapBundle(deps, body),
+            modules: _.reject(contents[i], function (path: string): boolean {
+                return shared.hasOwnProperty(path);
+            })
+        };
+    });
+
+    var standalone = _.map(roots, function (root: string, i: number): Bundle {
+        var emitter = createModuleEmitter(modules, deferred, {}, false);
+        var body = emitRoot(emitter, root, modules);
+        return {
+            ast: wrapBundle(emitter.deferredUsed, body),
+            modules: contents[i]
+        };
+    });
+
+    return {
+        shared: {
+            ast: wrapBundle(chunkEmitter.deferredUsed, chunkBody),
+            modules: sharedPaths
+        },
+        entries: entries,
+        standalone: standalone
+    };
+}
+
+// The aliases in module's dependency map its body never refers to.  Any
+// use of the imports object other than imports.name or imports['name'],
+// and any arguments, eval or with at the top of the body, counts as using
+// everything.
+export function findUnusedImports(module: ModuleInfo): string[] {
+    var aliases = Object.keys(module.deps);
+    if (!aliases.length || !module.body) {
+        return [];
+    }
+    if (!module.body.argnames.length) {
+        return aliases;
+    }
+
+    var name = module.body.argnames[0].name;
+    var used: PathSet = {};
+    var escapes = false;
+    var walker: any = new uglify.TreeWalker(function (node: uglify.AST_Node): boolean {
+        if (escapes) {
+            return true;
+        }
+        if (node instanceof uglify.AST_With) {
+            escapes = true;
+        } else if (node instanceof uglify.AST_SymbolRef) {
+            var ref = <uglify.AST_SymbolRef>node;
+            var parent = walker.parent();
+            if (ref.name === 'eval') {
+                escapes = true;
+            } else if (ref.name === 'arguments') {
+                escapes = walker.find_parent(uglify.AST_Lambda) === module.body;
+            } else if (ref.name === name) {
+                if (parent instanceof uglify.AST_Dot && parent.expression === node) {
+                    used[parent.property] = true;
+                } else if (parent instanceof uglify.AST_Sub && parent.expression === node &&
+                           parent.property instanceof uglify.AST_String) {
+                    used[parent.property.value] = true;
+                } else {
+                    escapes = true;
+                }
+            }
+        }
+        return undefined;
+    });
+    module.body.walk(walker);
+
+    if (escapes) {
+        return [];
+    }
+    return _.reject(aliases, function (alias: string): boolean {
+        return used.hasOwnProperty(alias);
+    });
+}
+
+// Removes every unused import, then every module the roots no longer
+// reach.  A module imported only for its side effects goes too, which is
+// why this is optional.  Returns the removed modules.
+export function dropUnusedImports(readModules: ReadModulesResult, roots: string[]): string[] {
+    var modules = readModules.resolved;
+    _.each(modules, function (module: ModuleInfo): void {
+        _.each(findUnusedImports(module), function (alias: string): void {
+            delete module.deps[alias];
+        });
+    });
+
+    var reached: PathSet = {};
+    _.each(roots, function (root: string): void {
+        _.each(reachableFrom(root, modules, {}), function (path: string): void {
+            reached[path] = true;
+        });
+    });
+
+    var dropped = _.reject(Object.keys(modules), function (path: string): boolean {
+        return reached.hasOwnProperty(path);
+    });
+    _.each(dropped, function (path: string): void {
+        delete modules[path];
+    });
+    readModules.aliases = _.filter(readModules.aliases, function (path: string): boolean {
+        return reached.hasOwnProperty(path);
+    });
+    readModules.customActions = _.filter(readModules.customActions, function (path: string): boolean {
+        return reached.hasOwnProperty(path);
+    });
+    return dropped;
+}
+
+export interface ModuleSizes {
+    raw: number;
+    minified: number;
+    gzip: number;
+}
+
+export interface ModuleReport extends ModuleSizes {
+    importedBy: string[];
+    unusedImports: string[];
+}
+
+export interface SizeReport {
+    roots: string[];
+    total: ModuleSizes;
+    modules: { [path: string]: ModuleReport };
+    // modules dropped by dropUnusedImports
+    dropped: string[];
+}
+
+function fileSizes(filename: string): ModuleSizes {
+    var code = fs.readFileSync(filename, 'utf8');
+    var minified = uglify.minify(code, { fromString: true }).code;
+    return {
+        raw: Buffer.byteLength(code),
+        minified: Buffer.byteLength(minified),
+        gzip: (<any>zlib).gzipSync(minified).length
+    };
+}
+
+// Where a bundle's bytes come from: each module file's size as written,
+// minified and gzipped, who imports it, and which of its own imports it
+// doesn't use.
+export function sizeReport(readModules: ReadModulesResult, roots: string[]): SizeReport {
+    var modules = readModules.resolved;
+    var report: SizeReport = {
+        roots: roots,
+        total: { raw: 0, minified: 0, gzip: 0 },
+        modules: {},
+        dropped: []
+    };
+
+    _.each(modules, function (module: ModuleInfo, path: string): void {
+        // aliases and custom actions aren't files
+        if (!module.body) {
+            return;
+        }
+        var sizes = fileSizes(path);
+        report.total.raw += sizes.raw;
+        report.total.minified += sizes.minified;
+        report.total.gzip += sizes.gzip;
+        report.modules[path] = {
+            raw: sizes.raw,
+            minified: sizes.minified,
+            gzip: sizes.gzip,
+            importedBy: [],
+            unusedImports: findUnusedImports(module)
+        };
+    });
+    _.each(modules, function (module: ModuleInfo, importer: string): void {
+        _.each(_.uniq(_.values(module.deps)), function (path: string): void {
+            if (report.modules.hasOwnProperty(path)) {
+                report.modules[path].importedBy.push(importer);
+            }
+        });
+    });
+    return report;
+}
+
 export function saveModule(module: ModuleInfo): uglify.AST_Toplevel {
     var imports : uglify.AST_ObjectProperty[] = [];
     var deps = module.deps;
@@ -512,57 +1282,199 @@ export function saveModule(module: ModuleInfo): uglify.AST_Toplevel {
 }
 
 function usage() {
-    console.log('usage: combine file.js > newfile.js');
+    console.log('usage: combine [--alias NAME=PATH] [--jobs N|auto] [--depfile FILE] file.js > newfile.js');
+    console.log('       combine [options] [--min-shared N] --shared-chunk CHUNK.js root.js=bundle.js ...');
+    console.log('options: --out FILE       write the bundle to FILE instead of stdout');
+    console.log('         --drop-unused    leave out imports the importer never uses');
+    console.log('         --report FILE    write a JSON report of module sizes and imports');
+}
+
+// Records every file the output was combined from, with the mtime and
+// size it had, so build tools can reuse the list instead of scanning the
+// modules again until one of them changes.  Imports that didn't resolve
+// are recorded too: creating one of them changes the list as well.
+function writeDepfile(depfile: string, roots: string[], m: ReadModulesResult): void {
+    var files: { [filename: string]: number[] } = {};
+    Object.keys(m.resolved).forEach(function (filename: string): void {
+        // aliases and custom actions aren't files
+        if (fs.existsSync(filename)) {
+            var st = fs.statSync(filename);
+            files[filename] = [st.mtime.getTime(), st.size];
+        }
+    });
+    fs.writeFileSync(depfile, JSON.stringify({
+        version: 2,
+        roots: roots,
+        aliases: globalAliases,
+        files: files,
+        missing: Object.keys(m.missing).sort()
+    }, null, 2) + '\n');
+}
+
+function sourcesComment(sources: string[]): string {
+    return ['/*', 'Source files:', ''].concat(_.map(sources, function (source: string): string {
+        return '  ' + source;
+    })).concat(['', '*/']).join('\n');
 }
 
-function main(argv: string[]) {
+function bundleText(bundle: Bundle): string {
+    return sourcesComment(bundle.modules) + '\n' + gen_code(bundle.ast, {beautify: true}) + '\n';
+}
+
+// Writes the shared chunk and entry bundles, and reports how many bytes
+// splitting saved.
+function writeChunks(m: ReadModulesResult, chunkFile: string, roots: string[], outputs: string[], minShared: number): void {
+    var chunkUrls = _.map(outputs, function (output: string): string {
+        return path.relative(path.dirname(output), chunkFile).replace(/\\/g, '/');
+    });
+    var chunks = combineChunks(m, roots, chunkUrls, minShared);
+
+    var shared = bundleText(chunks.shared);
+    fs.writeFileSync(chunkFile, shared);
+    var before = 0;
+    var after = Buffer.byteLength(shared);
+    console.log(chunkFile + ': ' + chunks.shared.modules.length + ' shared modules, ' + after + ' bytes');
+
+    _.each(outputs, function (output: string, i: number): void {
+        var text = bundleText(chunks.entries[i]);
+        fs.writeFileSync(output, text);
+        var size = Buffer.byteLength(text);
+        var standalone = Buffer.byteLength(bundleText(chunks.standalone[i]));
+        before += standalone;
+        after += size;
+        console.log(output + ': ' + standalone + ' -> ' + size + ' bytes');
+    });
+
+    var saved = before - after;
+    console.log('total: ' + before + ' -> ' + after + ' bytes, ' + saved + ' saved (' +
+        (before ? (100 * saved / before).toFixed(1) : '0.0') + '%)');
+}
+
+function main(argv: string[], done: (code: number) => void): void {
     var fix_output = require('../src/fix_output.js');
     fix_output.fixConsole(console);
 
     var fileName: string;
+    var jobs = 1;
+    var depfile: string;
+    var chunkFile: string;
+    var minShared = 2;
+    var roots: string[] = [];
+    var outputs: string[] = [];
+    var dropUnused = false;
+    var reportFile: string;
+    var outFile: string;
 
     for (var i = 2; i < argv.length; ++i) {
         if (argv[i] === '--alias' && (i + 1) < argv.length) {
             var eq = argv[i + 1].split('=', 2);
-            globalAliases[eq[0]] = eq[1];
+            setAlias(eq[0], eq[1]);
+            ++i;
+        } else if (argv[i] === '--jobs' && (i + 1) < argv.length) {
+            jobs = argv[i + 1] === 'auto' ?
+                os.cpus().length :
+                Math.max(1, parseInt(argv[i + 1], 10) || 1);
+            ++i;
+        } else if (argv[i] === '--depfile' && (i + 1) < argv.length) {
+            depfile = argv[i + 1];
+            ++i;
+        } else if (argv[i] === '--shared-chunk' && (i + 1) < argv.length) {
+            chunkFile = argv[i + 1];
+            ++i;
+        } else if (argv[i] === '--out' && (i + 1) < argv.length) {
+            outFile = argv[i + 1];
+            ++i;
+        } else if (argv[i] === '--drop-unused') {
+            dropUnused = true;
+        } else if (argv[i] === '--report' && (i + 1) < argv.length) {
+            reportFile = argv[i + 1];
+            ++i;
+        } else if (argv[i] === '--min-shared' && (i + 1) < argv.length) {
+            minShared = Math.max(1, parseInt(argv[i + 1], 10) || 2);
             ++i;
         } else {
-            if (fileName) {
-                throw new Error('ES5: Only one input file can be given');
-            }
-            fileName = argv[i];
+            var pair = argv[i].split('=', 2);
+            roots.push(pair[0]);
+            outputs.push(pair[1]);
         }
     }
 
-    if (!fileName) {
-        usage();
-        return 1;
+    if (chunkFile) {
+        if (!roots.length || _.contains(outputs, undefined)) {
+            usage();
+            done(1);
+            return;
+        }
+    } else {
+        if (roots.length > 1) {
+            throw new Error('ES5: Only one input file can be given');
+        }
+        fileName = roots[0];
+        if (!fileName) {
+            usage();
+            done(1);
+            return;
+        }
     }
 
-    try {
-        var m = readModules(fileName);
-        var newScript = combine(m, fileName);
-
-        console.log("/*");
-        console.log('Source files:');
-        console.log('');
-        Object.keys(m.resolved).forEach(function (i) {
-            console.log("  " + i);
-        });
-
-        console.log('');
-        console.log("*/");
+    function finish(error: any, m?: ReadModulesResult) {
+        var output: OutputBuffer;
+        try {
+            if (error) {
+                throw error;
+            }
 
-        console.log(gen_code(newScript, {beautify: true}));
+            // Both before anything is dropped: the depfile should list what
+            // a dependency scan finds, and the report what could be dropped.
+            if (depfile) {
+                writeDepfile(depfile, roots, m);
+            }
+            var report = reportFile ? sizeReport(m, roots) : null;
+            if (dropUnused) {
+                var dropped = dropUnusedImports(m, roots);
+                if (report) {
+                    report.dropped = dropped;
+                }
+            }
+            if (report) {
+                fs.writeFileSync(reportFile, JSON.stringify(report, null, 2) + '\n');
+            }
 
-    } catch (e) {
-        if (e instanceof ScriptError) {
-            errorExit(e.message);
+            if (chunkFile) {
+                writeChunks(m, chunkFile, roots, outputs, minShared);
+            } else {
+                output = createOutputBuffer(outFile);
+                output.write(sourcesComment(Object.keys(m.resolved)) + '\n');
+                streamCombine(m, fileName, output);
+                output.close();
+            }
+        } catch (e) {
+            // don't leave half a bundle behind
+            if (output && outFile) {
+                output.close();
+                fs.unlinkSync(outFile);
+            }
+            if (e instanceof ScriptError) {
+                errorExit(e.message);
+            }
+            throw e;
         }
-        throw e;
+
+        done(0);
     }
 
-    return 0;
+    if (jobs > 1) {
+        readAllModulesParallel(roots, jobs, finish);
+    } else {
+        var m: ReadModulesResult;
+        try {
+            m = readAllModules(roots);
+        } catch (e) {
+            finish(e);
+            return;
+        }
+        finish(null, m);
+    }
 }
 
 export function gen_code(ast: uglify.AST_Node, options: uglify.OutputStreamOptions) {
@@ -572,5 +1484,11 @@ export function gen_code(ast: uglify.AST_Node, options: uglify.OutputStreamOptio
 }
 
 if (null === module.parent) {
-    process.exit(main(process.argv));
+    if (process.argv[2] === '--worker') {
+        runWorker();
+    } else {
+        main(process.argv, function (code: number): void {
+            process.exit(code);
+        });
+    }
 }
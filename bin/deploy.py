@@ -0,0 +1,226 @@
+"""Deploys the build's output to a directory.
+
+usage:
+    deploy.py [-j N] [--keep N] DIRECTORY
+
+Deploys the files out/deploy.json lists (see SConstruct): the installable
+targets, and the fingerprinted copies with their manifest.json.  Build
+first.
+
+DIRECTORY is a symlink to a version directory under DIRECTORY.versions/.
+Each deploy fills a new version directory and then replaces the symlink
+in one rename, so a reader sees either the old deploy or the new one,
+never a mix of the two.  Files whose contents match the previous version
+are hard links to it, so only changed files are copied.  Fingerprinted
+copies are carried into every later version, for pages that still have an
+older manifest.  Only the newest --keep versions are kept.
+"""
+
+import errno
+import hashlib
+import json
+import multiprocessing
+import multiprocessing.pool
+import optparse
+import os
+import shutil
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+OUT = os.path.join(ROOT, 'out')
+
+# in each version directory: name : {'hash', 'size', 'source', 'fingerprinted'}
+RECORD = '.deploy.json'
+
+class DeployError(Exception):
+    pass
+
+def read_json(path):
+    try:
+        return json.load(open(path, 'rb'))
+    except (IOError, ValueError):
+        return None
+
+def deployable_files():
+    """Returns [(deployed name, source path, fingerprinted?)]."""
+    deploy_list = read_json(os.path.join(OUT, 'deploy.json'))
+    if deploy_list is None:
+        raise DeployError('out/deploy.json is missing; run s/build first')
+
+    files = [(name, os.path.join(OUT, name), False) for name in deploy_list['files']]
+    manifest_path = os.path.join(OUT, deploy_list['fingerprinted'])
+    manifest = read_json(manifest_path)
+    if manifest is None:
+        raise DeployError('%s is missing; run s/build first' % (manifest_path,))
+    # Manifest names are relative to the deployed root.
+    fingerprinted_dir = os.path.dirname(manifest_path)
+    for fingerprinted in sorted(manifest.values()):
+        files.append((fingerprinted, os.path.join(fingerprinted_dir, fingerprinted), True))
+    files.append(('manifest.json', manifest_path, False))
+
+    seen = set()
+    for name, source, _ in files:
+        if name in seen:
+            raise DeployError('%s would be deployed twice' % (name,))
+        if not os.path.isfile(source):
+            raise DeployError('File missing: %s' % (source,))
+        seen.add(name)
+    return files
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    f = open(path, 'rb')
+    try:
+        for block in iter(lambda: f.read(1 << 16), ''):
+            digest.update(block)
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+def describe(previous, name, source, fingerprinted):
+    """The record entry for deploying source as name.  The hash is reused
+    while source's mtime and size match the previous deploy's."""
+    st = os.stat(source)
+    stamp = [st.st_mtime, st.st_size]
+    old = previous.get(name)
+    if old is not None and old['source'] == stamp:
+        digest = old['hash']
+    else:
+        digest = file_hash(source)
+    return name, {
+        'hash': digest,
+        'size': st.st_size,
+        'source': stamp,
+        'fingerprinted': fingerprinted,
+    }
+
+def place(current_dir, previous, staging, name, entry, source):
+    """Links name from the current version if it's unchanged, otherwise
+    copies it from source.  Returns the bytes copied, or None if linked."""
+    target = os.path.join(staging, name)
+    if not os.path.isdir(os.path.dirname(target)):
+        try:
+            os.makedirs(os.path.dirname(target))
+        except OSError, e:
+            # another worker made it first
+            if e.errno != errno.EEXIST:
+                raise
+    old = previous.get(name)
+    if old is not None and old['hash'] == entry['hash']:
+        try:
+            os.link(os.path.join(current_dir, name), target)
+            return None
+        except OSError:
+            pass
+    shutil.copyfile(source, target)
+    return entry['size']
+
+def version_name(record):
+    digest = hashlib.sha1()
+    for name in sorted(record):
+        digest.update('%s %s\n' % (name, record[name]['hash']))
+    return '%s-%s' % (time.strftime('%Y%m%d-%H%M%S'), digest.hexdigest()[:8])
+
+def deploy(directory, jobs, keep):
+    start = time.time()
+    directory = os.path.abspath(directory.rstrip('/'))
+    versions = directory + '.versions'
+    if os.path.exists(directory) and not os.path.islink(directory):
+        raise DeployError(
+            '%s is not a symlink.  Move it aside; deploy.py replaces it with a '
+            'symlink into %s.' % (directory, versions))
+    if not os.path.isdir(versions):
+        os.makedirs(versions)
+
+    current_dir = None
+    previous = {}
+    if os.path.islink(directory):
+        current_dir = os.path.join(os.path.dirname(directory), os.readlink(directory))
+        previous = read_json(os.path.join(current_dir, RECORD)) or {}
+
+    files = deployable_files()
+    sources = dict((name, source) for name, source, _ in files)
+    pool = multiprocessing.pool.ThreadPool(jobs)
+    try:
+        record = dict(pool.map(lambda f: describe(previous, *f), files))
+
+        # Earlier fingerprinted copies stay deployed.
+        for name, entry in previous.items():
+            if entry['fingerprinted'] and name not in record:
+                record[name] = entry
+                sources[name] = os.path.join(current_dir, name)
+
+        unchanged = (
+            sorted(record) == sorted(previous) and
+            all(record[name]['hash'] == previous[name]['hash'] for name in record))
+        if unchanged:
+            print '%s is up to date (%.0f ms)' % (directory, (time.time() - start) * 1000)
+            return
+
+        staging = os.path.join(versions, '.staging-%d' % (os.getpid(),))
+        if os.path.exists(staging):
+            shutil.rmtree(staging)
+        os.makedirs(staging)
+        try:
+            copied = pool.map(
+                lambda name: place(current_dir, previous, staging, name, record[name], sources[name]),
+                sorted(record))
+            output = open(os.path.join(staging, RECORD), 'wb')
+            json.dump(record, output, indent=2, separators=(',', ': '), sort_keys=True)
+            output.close()
+
+            version = base = version_name(record)
+            suffix = 1
+            while os.path.exists(os.path.join(versions, version)):
+                suffix += 1
+                version = '%s-%d' % (base, suffix)
+            os.rename(staging, os.path.join(versions, version))
+        except:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+    finally:
+        # Every map() has returned.  Joining would only wait out the pool's
+        # 100 ms shutdown poll, and its threads are daemons.
+        pool.close()
+
+    # rename() replaces the old symlink atomically.
+    link = directory + '.new-%d' % (os.getpid(),)
+    os.symlink(os.path.relpath(os.path.join(versions, version), os.path.dirname(directory)), link)
+    os.rename(link, directory)
+
+    prune(versions, version, keep)
+
+    copies = [size for size in copied if size is not None]
+    print 'Deployed %s: %d files, %d copied (%d bytes), %d unchanged, in %.0f ms' % (
+        os.path.join(os.path.basename(versions), version), len(record), len(copies),
+        sum(copies), len(record) - len(copies), (time.time() - start) * 1000)
+
+def prune(versions, current, keep):
+    # oldest first; names only order versions to the second
+    names = sorted(
+        (name for name in os.listdir(versions) if not name.startswith('.')),
+        key=lambda name: (os.stat(os.path.join(versions, name)).st_mtime, name))
+    for name in names[:-keep]:
+        if name != current:
+            shutil.rmtree(os.path.join(versions, name), ignore_errors=True)
+
+def main(argv):
+    parser = optparse.OptionParser(usage='deploy.py [options] DIRECTORY')
+    parser.add_option('-j', '--jobs', type='int', default=multiprocessing.cpu_count(),
+                      help='files hashed or copied at once (default: CPU count)')
+    parser.add_option('--keep', type='int', default=5,
+                      help='version directories to keep, including the new one (default: 5)')
+    options, args = parser.parse_args(argv[1:])
+    if len(args) != 1:
+        parser.error('expected one directory')
+
+    try:
+        deploy(args[0], max(1, options.jobs), max(1, options.keep))
+    except DeployError, e:
+        print >>sys.stderr, 'Error: %s' % (e,)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,361 @@
+"""Development HTTP server for imvujs.
+
+usage:
+    devserver.py [--port 8000] [--bind 127.0.0.1] [--alias NAME=PATH ...]
+
+Serves the repository root like `python -m SimpleHTTPServer`, but handles
+requests on multiple threads and keeps HTTP/1.1 connections alive, so a
+test page that loads hundreds of module files doesn't queue them one
+connection at a time.
+
+GET /combined/path/to/root.js returns that module combined with all of
+its dependencies, the same way the CombinedModule builder does it.  The
+bundle is kept in memory and rebuilt when any of its source files change.
+
+Every response carries a strong ETag computed from its content, and
+matching If-None-Match (or If-Modified-Since) requests get a 304.  If the
+client accepts gzip and a file has an up-to-date .gz sibling, such as
+out/imvu.min.js.gz, the sibling is sent instead.  Fingerprinted URLs
+(name.0123abcd.js) are cacheable for a year; everything else must be
+revalidated.
+"""
+
+import BaseHTTPServer
+import SimpleHTTPServer
+import SocketServer
+import StringIO
+import email.utils
+import hashlib
+import optparse
+import os
+import re
+import subprocess
+import sys
+import threading
+import urllib
+import urlparse
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+NODE = os.path.join(ROOT, 's', 'node')
+COMBINE = os.path.join(ROOT, 'bin', 'combine.js')
+
+COMBINED_PREFIX = '/combined/'
+
+# A content hash in the file name, e.g. imvu.min.3f9a1c0e.js
+FINGERPRINTED = re.compile(r'\.[0-9a-f]{8,}\.[^./]+$')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+def content_etag(data):
+    return '"%s"' % hashlib.sha1(data).hexdigest()
+
+class ETagCache(object):
+    """Content-hash ETags for files, recomputed only when a file's
+    inode, size or mtime changes.  The hash is of the open file that is
+    about to be served, so a file replaced in between can't get the other
+    file's ETag."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.etags = {} # path : (stat key, etag)
+
+    def get(self, path, f, st):
+        """f is path, open, and st its fstat.  f is left at the start."""
+        key = (st.st_ino, st.st_size, st.st_mtime)
+        with self.lock:
+            cached = self.etags.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        digest = hashlib.sha1()
+        for chunk in iter(lambda: f.read(1 << 16), ''):
+            digest.update(chunk)
+        f.seek(0)
+        etag = '"%s"' % digest.hexdigest()
+        with self.lock:
+            self.etags[path] = (key, etag)
+        return etag
+
+class CombineError(Exception):
+    pass
+
+class Bundle(object):
+    def __init__(self, root, aliases):
+        self.root = root
+        self.aliases = aliases
+        self.lock = threading.Lock()
+        self.body = None
+        self.etag = None
+        self.signatures = {} # path : signature when body was built
+
+    def is_current(self):
+        if self.body is None:
+            return False
+        for path, signature in self.signatures.iteritems():
+            if file_signature(path) != signature:
+                return False
+        return True
+
+    def build(self):
+        command = [NODE, COMBINE]
+        for name, value in sorted(self.aliases.items()):
+            command.extend(['--alias', '%s=%s' % (name, value)])
+        command.append(self.root)
+
+        # Take the signatures first, so an edit made while combine runs
+        # triggers another rebuild.
+        before = dict((path, file_signature(path)) for path in self.sources() + [COMBINE])
+
+        popen = subprocess.Popen(
+            command, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = popen.communicate()
+        if popen.returncode:
+            raise CombineError(stderr or stdout)
+
+        # The output starts with a comment listing every source file, which
+        # replaces the last build's list: a module nothing imports anymore
+        # shouldn't trigger rebuilds.  Ones we didn't know about are new
+        # since the last build, so stat them now.
+        sources = [os.path.join(ROOT, path) for path in self.parse_sources(stdout)]
+        self.body = stdout
+        self.etag = content_etag(stdout)
+        self.signatures = dict(
+            (path, before[path] if path in before else file_signature(path))
+            for path in sources + [os.path.join(ROOT, self.root), COMBINE])
+
+    def sources(self):
+        return self.signatures.keys() or [os.path.join(ROOT, self.root)]
+
+    @staticmethod
+    def parse_sources(output):
+        sources = []
+        lines = iter(output.splitlines())
+        for line in lines:
+            if line.strip() == 'Source files:':
+                break
+        for line in lines:
+            line = line.strip()
+            if line == '*/':
+                break
+            # skip aliases and plugin resources, which aren't files
+            if line and not line.startswith('@') and '!' not in line:
+                sources.append(line)
+        return sources
+
+    def get(self):
+        with self.lock:
+            if not self.is_current():
+                self.build()
+            return self.body, self.etag
+
+class BundleCache(object):
+    """Combined bundles by root module.  Different roots build in
+    parallel; concurrent requests for the same root share one build."""
+
+    def __init__(self, aliases=None):
+        self.aliases = dict(aliases or {})
+        self.lock = threading.Lock()
+        self.bundles = {}
+
+    def get(self, root):
+        with self.lock:
+            bundle = self.bundles.get(root)
+            if bundle is None:
+                bundle = self.bundles[root] = Bundle(root, self.aliases)
+        return bundle.get()
+
+class RequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers are written a line at a time; with Nagle on, keep-alive
+    # responses would wait on the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def translate_path(self, path):
+        """Maps URLs onto the repository root no matter what the working
+        directory is."""
+        path = urllib.unquote(urlparse.urlsplit(path).path)
+        parts = [p for p in path.split('/') if p not in ('', '.', '..')]
+        return os.path.join(ROOT, *parts)
+
+    def send_head(self):
+        url = urlparse.urlsplit(self.path)
+        if url.path.startswith(COMBINED_PREFIX):
+            return self.send_bundle(url.path[len(COMBINED_PREFIX):])
+
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) and not url.path.endswith('/'):
+            # SimpleHTTPRequestHandler's redirect has no body length, which
+            # would stall a keep-alive client.
+            self.send_response(301)
+            self.send_header('Location', urlparse.urlunsplit(
+                (url[0], url[1], url[2] + '/', url[3], url[4])))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+        if os.path.isdir(path):
+            return SimpleHTTPServer.SimpleHTTPRequestHandler.send_head(self)
+        return self.send_file(path, url.path)
+
+    def accepts_gzip(self):
+        # coding : quality
+        qualities = {}
+        for coding in self.headers.get('Accept-Encoding', '').split(','):
+            parts = [p.strip() for p in coding.split(';')]
+            quality = 1.0
+            for param in parts[1:]:
+                if param.lower().startswith('q='):
+                    try:
+                        quality = float(param[2:])
+                    except ValueError:
+                        pass
+            qualities[parts[0].lower()] = quality
+        # An explicit gzip entry wins over *, so "*, gzip;q=0" means no,
+        # and q=0 means the opposite of accepting it.
+        return qualities.get('gzip', qualities.get('*', 0)) > 0
+
+    def not_modified(self, etag, mtime):
+        """Checks the request's validators against the current ones, as
+        RFC 7232 says: If-None-Match wins over If-Modified-Since."""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            # If-None-Match compares weakly: W/"x" matches "x".
+            tags = [re.sub(r'^W/', '', t.strip()) for t in if_none_match.split(',')]
+            return '*' in tags or re.sub(r'^W/', '', etag) in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None and mtime is not None:
+            since = email.utils.parsedate_tz(if_modified_since)
+            if since is not None:
+                return int(mtime) <= email.utils.mktime_tz(since)
+        return False
+
+    def send_cached_headers(self, status, ctype, etag, mtime, url_path, length, encoding=None, vary=False):
+        self.send_response(status)
+        self.send_header('Content-Type', ctype)
+        self.send_header('ETag', etag)
+        if mtime is not None:
+            self.send_header('Last-Modified', self.date_time_string(mtime))
+        if FINGERPRINTED.search(url_path):
+            self.send_header('Cache-Control', IMMUTABLE)
+        else:
+            self.send_header('Cache-Control', REVALIDATE)
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        if vary:
+            self.send_header('Vary', 'Accept-Encoding')
+        if status != 304:
+            self.send_header('Content-Length', str(length))
+        self.end_headers()
+
+    def send_file(self, path, url_path):
+        ctype = self.guess_type(path)
+        encoding = None
+        body_path = path
+
+        compressed = path + '.gz'
+        vary = os.path.isfile(compressed)
+        if vary and self.accepts_gzip() and os.path.isfile(path):
+            # A stale .gz would serve old content, so only use it if it's
+            # at least as new as the file it compresses.
+            if os.stat(compressed).st_mtime >= os.stat(path).st_mtime:
+                body_path = compressed
+                encoding = 'gzip'
+
+        try:
+            f = open(body_path, 'rb')
+        except IOError:
+            self.send_error(404, "File not found")
+            return None
+        try:
+            st = os.fstat(f.fileno())
+            etag = self.server.etags.get(body_path, f, st)
+            if self.not_modified(etag, st.st_mtime):
+                f.close()
+                self.send_cached_headers(304, ctype, etag, st.st_mtime, url_path, 0, encoding, vary)
+                return None
+            self.send_cached_headers(200, ctype, etag, st.st_mtime, url_path, st.st_size, encoding, vary)
+            return f
+        except:
+            f.close()
+            raise
+
+    def send_bundle(self, root):
+        root = os.path.normpath(urllib.unquote(root)).replace('\\', '/')
+        # An absolute root would replace ROOT in the join, and .. or a
+        # symlink could lead out of it.
+        path = os.path.realpath(os.path.join(ROOT, root))
+        if (os.path.isabs(root) or
+                not path.startswith(os.path.join(os.path.realpath(ROOT), '')) or
+                not os.path.isfile(path)):
+            self.send_error(404, 'No such module')
+            return None
+        try:
+            body, etag = self.server.bundles.get(root)
+        except CombineError, e:
+            self.send_response(500)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(str(e))))
+            self.end_headers()
+            return StringIO.StringIO(str(e))
+
+        ctype = 'application/javascript'
+        if self.not_modified(etag, None):
+            self.send_cached_headers(304, ctype, etag, None, root, 0)
+            return None
+        self.send_cached_headers(200, ctype, etag, None, root, len(body))
+        return StringIO.StringIO(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            SimpleHTTPServer.SimpleHTTPRequestHandler.log_message(self, format, *args)
+
+class DevServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, aliases=None, quiet=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, RequestHandler)
+        self.bundles = BundleCache(aliases)
+        self.etags = ETagCache()
+        self.quiet = quiet
+
+    def start(self):
+        """Serves from a background thread.  The socket is already
+        listening once the constructor returns, so clients can connect
+        immediately."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+def main(argv):
+    parser = optparse.OptionParser(usage='devserver.py [options]')
+    parser.add_option('-p', '--port', type='int', default=8000)
+    parser.add_option('--bind', default='127.0.0.1',
+                      help='address to listen on (default: 127.0.0.1; 0.0.0.0 for every interface)')
+    parser.add_option('--alias', action='append', default=[],
+                      help='NAME=PATH alias passed to combine for /combined/ bundles')
+    parser.add_option('-q', '--quiet', action='store_true')
+    options, args = parser.parse_args(argv[1:])
+
+    aliases = dict(alias.split('=', 1) for alias in options.alias)
+    server = DevServer((options.bind, options.port), aliases, options.quiet)
+    host, port = server.socket.getsockname()[:2]
+    print 'Serving %s on http://%s:%d/ ...' % (ROOT, host, port)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
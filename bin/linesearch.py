@@ -0,0 +1,118 @@
+"""Parallel, memory-mapped regex search used by the `search` subcommand in
+main.ibb.  Lives in its own module so pool workers can import it."""
+
+import functools
+import mmap
+import multiprocessing
+import re
+
+# Below this many files, starting work in the pool costs more than it saves.
+MIN_PARALLEL_FILES = 16
+
+_LINE_BREAK = re.compile(br'\r\n?')
+
+@functools.lru_cache(maxsize=64)
+def _matcher(pattern):
+    # MULTILINE so ^ and $ match at every line, as they do when each line
+    # is searched on its own.
+    return re.compile(pattern.encode('latin-1'), re.IGNORECASE | re.MULTILINE)
+
+# bytes copied at a time when counting newlines in an mmap
+_COUNT_CHUNK = 1 << 20
+
+def _newlines(data, start, end):
+    if isinstance(data, bytes):
+        return data.count(b'\n', start, end)
+    # mmap has no count() before Python 3.13.  Counting a copied slice is
+    # faster than anything that doesn't copy, so copy a chunk at a time.
+    return sum(
+        data[i:min(i + _COUNT_CHUNK, end)].count(b'\n')
+        for i in range(start, end, _COUNT_CHUNK))
+
+def _search(path, data, pattern):
+    """Returns (path, [(lineno, line), ...], lineno of the first match or
+    None).  The list has the lines that match on their own.  A file can
+    match only across lines, in which case the list is empty.
+
+    data is bytes or an mmap.  The whole file is searched once.  Only the
+    lines a match touches are searched again, and line numbers come from
+    counting newlines between matches."""
+    matcher = _matcher(pattern)
+    # splitlines() used to end lines at \r\n and \r too.  Without this,
+    # $ wouldn't match before a \r.  Only files with a \r are copied.
+    if data.find(b'\r') != -1:
+        data = _LINE_BREAK.sub(b'\n', data)
+    matches = []
+    firstMatch = None
+    lineno = 1
+    counted = 0 # newlines before this offset are included in lineno
+    searchedTo = 0 # lines starting before this offset have been searched
+    for match in matcher.finditer(data):
+        if firstMatch is None:
+            lineno += _newlines(data, counted, match.start())
+            counted = match.start()
+            firstMatch = lineno
+        # each line the match touches, unless an earlier match did
+        lineStart = max(data.rfind(b'\n', 0, match.start()) + 1, searchedTo)
+        last = max(match.start(), match.end() - 1)
+        while lineStart <= last and lineStart < len(data):
+            lineEnd = data.find(b'\n', lineStart)
+            if lineEnd == -1:
+                lineEnd = len(data)
+            lineno += _newlines(data, counted, lineStart)
+            counted = lineStart
+            line = data[lineStart:lineEnd]
+            if matcher.search(line):
+                matches.append((lineno, line.decode('latin-1')))
+            lineStart = searchedTo = lineEnd + 1
+    return path, matches, firstMatch
+
+def searchFile(args):
+    """_search on (path, contents, pattern), for contents already read."""
+    return _search(*args)
+
+def searchMappedFile(args):
+    """_search on (path, pattern), memory-mapping the file, so a pool
+    worker is sent only the path."""
+    path, pattern = args
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return path, [], None
+    with f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return path, [], None
+        with data:
+            return _search(path, data, pattern)
+
+class LineSearcher(object):
+    """Shards searches across a lazily created, reused process pool."""
+
+    def __init__(self, processes=None):
+        self.__processes = processes
+        self.__pool = None
+
+    def search(self, files, pattern):
+        """files is [(path, contents)].  Yields _search's results in the
+        order of files, as soon as each file's are ready.
+
+        A few files are searched here, in the contents the caller already
+        has.  More are sharded across the pool by path, and each worker
+        maps its files itself: pickling every file's contents to the
+        workers would cost more than searching them in one process."""
+        if len(files) < MIN_PARALLEL_FILES:
+            return (searchFile((path, data, pattern)) for path, data in files)
+        if self.__pool is None:
+            self.__pool = multiprocessing.Pool(self.__processes)
+        work = [(path, pattern) for path, _ in files]
+        chunksize = max(1, len(work) // (8 * (self.__processes or multiprocessing.cpu_count())))
+        return self.__pool.imap(searchMappedFile, work, chunksize)
+
+    def close(self):
+        if self.__pool is not None:
+            self.__pool.close()
+            self.__pool.join()
+            self.__pool = None
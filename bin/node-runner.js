@@ -4,24 +4,47 @@
 
 var fs = require('fs');
 var vm = require('vm');
+var os = require('os');
 var path = require('path');
 var util = require('util');
+var child_process = require('child_process');
 
 var fix_output = require('../src/fix_output.js');
 fix_output.fixConsole(console);
-var syncWrite = fix_output.syncWriteStdout;
+
+// Looked up on every call so a worker can redirect output to its parent.
+function syncWrite(data) {
+    fix_output.syncWriteStdout(data);
+}
 
 function endsWith(str, suffix) {
     return str.indexOf(suffix, str.length - suffix.length) !== -1;
 }
 
-global.require = require;
+var syncRunner;
+
+function loadTestEnvironment() {
+    global.require = require;
+
+    var imvu_node = require('../out/imvu.node.js');
+    global.module = imvu_node.module;
+    global.IMVU = imvu_node.IMVU;
+    global.Backbone = imvu_node.Backbone;
+    global._ = imvu_node._;
 
-var imvu_node = require('../out/imvu.node.js');
-global.module = imvu_node.module;
-global.IMVU = imvu_node.IMVU;
-global.Backbone = imvu_node.Backbone;
-global._ = imvu_node._;
+    runInDirectory(__dirname, function () {
+         // node-module.js loads js relative to process.cwd(), we can't rely on
+         // this, so we change to __dirname to import relative to *here*
+        global.module({
+            SyncRunner: '../src/imvujstest/SyncRunner.js',
+            testglobals: '../src/imvujstest/testglobals.js'
+        }, function(imports) {
+            syncRunner = new imports.SyncRunner();
+            imports.testglobals.injectTestGlobals(syncRunner);
+            imports.testglobals.replaceIntermittentGlobals();
+        });
+    });
+}
 
 function runInDirectory(dir, action) {
     var previousDir = process.cwd();
@@ -34,23 +57,9 @@ function runInDirectory(dir, action) {
     }
 }
 
-var syncRunner;
-
-runInDirectory(__dirname, function () {
-     // node-module.js loads js relative to process.cwd(), we can't rely on
-     // this, so we change to __dirname to import relative to *here*
-    global.module({
-        SyncRunner: '../src/imvujstest/SyncRunner.js',
-        testglobals: '../src/imvujstest/testglobals.js'
-    }, function(imports) {
-        syncRunner = new imports.SyncRunner();
-        imports.testglobals.injectTestGlobals(syncRunner);
-        imports.testglobals.replaceIntermittentGlobals();
-    });
-});
-
 function usage() {
     console.log("Please pass a test file");
+    console.log("usage: node-runner.js [--superfixture FILE] [--alias NAME=PATH] [--jobs N|auto] [--keep-going] [--timings FILE] [--summary] test.js ...");
     process.exit(1);
 }
 
@@ -62,7 +71,8 @@ function loadSuperFixture(superfixture) {
     global.module({superfixture: abspath}, function(){});
 }
 
-function runTest(testPath, continuation) {
+// Appends {file, name, passed, details} to cases for each test run.
+function runTest(testPath, cases) {
     var abspath = path.resolve(testPath);
 
     var testPassed;
@@ -119,6 +129,12 @@ function runTest(testPath, continuation) {
             if (exception) {
                 syncWrite(exception);
             }
+            cases.push({
+                file: timingKey(testPath),
+                name: test.displayName,
+                passed: passed,
+                details: passed ? '' : (stack || '') + (exception ? String(exception) : '')
+            });
         }
     });
     var reporter = new ConsoleReporter();
@@ -126,46 +142,335 @@ function runTest(testPath, continuation) {
     return syncRunner.run_all(testPath, reporter);
 }
 
-function main() {
-    if (process.argv.length <= 2) {
-        return usage();
-    }
+var ROOT = path.resolve(__dirname, '..');
 
-    var tests = [];
-    var aliases = [];
-    var superfixtures = [];
+function parseArgs(argv) {
+    var options = {
+        tests: [],
+        aliases: [],
+        superfixtures: [],
+        jobs: 1,
+        keepGoing: false,
+        summary: false,
+        timings: path.join(ROOT, 'out', '.test-timings.json'),
+        worker: false
+    };
 
-    var argv = process.argv;
     for (var i = 2; i < argv.length; ++i) {
         if (argv[i] === '--superfixture' && (i + 1) < argv.length) {
-            superfixtures.push(argv[i + 1]);
+            options.superfixtures.push(argv[i + 1]);
             ++i;
         } else if (argv[i] === '--alias' && (i + 1) < argv.length) {
-            aliases.push(argv[i + 1]);
+            options.aliases.push(argv[i + 1]);
             ++i;
+        } else if ((argv[i] === '--jobs' || argv[i] === '-j') && (i + 1) < argv.length) {
+            options.jobs = argv[i + 1] === 'auto' ?
+                os.cpus().length :
+                Math.max(1, parseInt(argv[i + 1], 10) || 1);
+            ++i;
+        } else if (argv[i] === '--keep-going' || argv[i] === '-k') {
+            options.keepGoing = true;
+        } else if (argv[i] === '--timings' && (i + 1) < argv.length) {
+            options.timings = path.resolve(argv[i + 1]);
+            ++i;
+        } else if (argv[i] === '--summary') {
+            options.summary = true;
+        } else if (argv[i] === '--worker') {
+            options.worker = true;
         } else {
-            tests.push(argv[i]);
+            options.tests.push(argv[i]);
         }
     }
+    return options;
+}
 
-    aliases.forEach(function(alias) {
+function workerArgs(options) {
+    var args = ['--worker'];
+    options.superfixtures.forEach(function(superfixture) {
+        args.push('--superfixture', path.resolve(superfixture));
+    });
+    options.aliases.forEach(function(alias) {
+        args.push('--alias', alias);
+    });
+    return args;
+}
+
+function prepareTestEnvironment(options) {
+    loadTestEnvironment();
+
+    options.aliases.forEach(function(alias) {
         var eq = alias.split('=', 2);
         global.module.setAlias(eq[0], eq[1]);
     });
 
-    for (var i = 0; i < superfixtures.length; ++i) {
-        loadSuperFixture(superfixtures[i]);
+    for (var i = 0; i < options.superfixtures.length; ++i) {
+        loadSuperFixture(options.superfixtures[i]);
     }
+}
 
-    for (var i = 0; i < tests.length; ++i) {
-        var test = tests[i];
+function timingKey(test) {
+    return path.relative(ROOT, path.resolve(test)).replace(/\\/g, '/');
+}
+
+function loadTimings(filename) {
+    try {
+        return JSON.parse(fs.readFileSync(filename, 'utf8'));
+    } catch (e) {
+        return {};
+    }
+}
+
+function saveTimings(filename, timings) {
+    try {
+        fs.writeFileSync(filename, JSON.stringify(timings, null, 1));
+    } catch (e) {
+        console.error('Could not save test timings to ' + filename + ': ' + e.message);
+    }
+}
+
+// With --summary, the last line of output is SUMMARY_PREFIX followed by
+// every test's case as JSON, for tools that would otherwise have to
+// parse the report meant for people.
+var SUMMARY_PREFIX = 'node-runner summary: ';
+
+function reportSummary(options, cases) {
+    if (options.summary) {
+        syncWrite('\n' + SUMMARY_PREFIX + JSON.stringify(cases) + '\n');
+    }
+}
+
+function reportFailures(failures) {
+    if (failures.length) {
+        syncWrite('\n' + failures.length + ' test file(s) failed:\n');
+        failures.forEach(function(test) {
+            syncWrite('    ' + test + '\n');
+        });
+    }
+}
+
+function runSerial(options) {
+    prepareTestEnvironment(options);
+
+    var timings = loadTimings(options.timings);
+    var failures = [];
+    var cases = [];
+    for (var i = 0; i < options.tests.length; ++i) {
+        var test = options.tests[i];
         syncWrite('\n');
-        if (!runTest(test)) {
+        var start = Date.now();
+        var passed = runTest(test, cases);
+        timings[timingKey(test)] = Date.now() - start;
+        if (!passed) {
             syncWrite('\n');
-            process.exit(1);
+            failures.push(test);
+            if (!options.keepGoing) {
+                saveTimings(options.timings, timings);
+                reportSummary(options, cases);
+                process.exit(1);
+            }
+        }
+    }
+    saveTimings(options.timings, timings);
+    reportFailures(failures);
+    reportSummary(options, cases);
+    process.exit(failures.length ? 1 : 0);
+}
+
+// testglobals.replaceIntermittentGlobals() makes these throw, which is
+// what tests want, but a worker needs the real ones to talk to its parent
+// between tests.
+var INTERMITTENT_GLOBALS = [
+    [global, 'setTimeout'],
+    [global, 'setInterval'],
+    [global, 'requestAnimationFrame'],
+    [process, 'nextTick'],
+    [Math, 'random']
+];
+
+function captureGlobals() {
+    return INTERMITTENT_GLOBALS.map(function(slot) {
+        return slot[0][slot[1]];
+    });
+}
+
+function installGlobals(values) {
+    INTERMITTENT_GLOBALS.forEach(function(slot, i) {
+        slot[0][slot[1]] = values[i];
+    });
+}
+
+// Runs test files sent by the parent one at a time, in the same way
+// runSerial does, and sends back everything each one prints when it
+// finishes.
+function runWorker(options) {
+    var output = [];
+    fix_output.syncWriteStdout = fix_output.syncWriteStderr = function(data) {
+        output.push(String(data));
+    };
+
+    var realGlobals = captureGlobals();
+    prepareTestEnvironment(options);
+    var testGlobals = captureGlobals();
+    installGlobals(realGlobals);
+
+    process.on('message', function(message) {
+        var start = Date.now();
+        var passed = false;
+        var cases = [];
+        output = [];
+        installGlobals(testGlobals);
+        try {
+            passed = runTest(message.test, cases);
+        } catch (e) {
+            var error = String(e && e.stack || e) + '\n';
+            output.push(error);
+            cases.push({file: timingKey(message.test), name: message.test, passed: false, details: error});
+        } finally {
+            installGlobals(realGlobals);
+        }
+        process.send({
+            test: message.test,
+            passed: passed,
+            duration: Date.now() - start,
+            output: output.join(''),
+            cases: cases
+        });
+    });
+    process.on('disconnect', function() {
+        process.exit(0);
+    });
+    process.send({ready: true});
+}
+
+// Hands test files to a pool of workers, longest first according to the
+// durations recorded by earlier runs, so the slow files don't all end up
+// at the end of the run.  Output is buffered per file: workers send back
+// everything a file printed once it finishes, and it's printed as one
+// block, so nothing shows while a file is running.  Use --jobs 1 to watch
+// a file that hangs.
+function runParallel(options) {
+    var timings = loadTimings(options.timings);
+    function expected(test) {
+        var key = timingKey(test);
+        // unknown tests first: they could be slow
+        return timings.hasOwnProperty(key) ? timings[key] : Number.MAX_VALUE;
+    }
+
+    var queue = options.tests.slice();
+    queue.sort(function(a, b) {
+        return expected(b) - expected(a);
+    });
+
+    var failures = [];
+    var cases = [];
+    var workers = [];
+    var finished = false;
+
+    function finish() {
+        if (finished) {
+            return;
+        }
+        finished = true;
+        workers.forEach(function(worker) {
+            worker.kill();
+        });
+        saveTimings(options.timings, timings);
+        reportFailures(failures);
+        reportSummary(options, cases);
+        process.exit(failures.length ? 1 : 0);
+    }
+
+    function fail(test) {
+        failures.push(test);
+        if (!options.keepGoing) {
+            finish();
         }
     }
-    process.exit(0);
+
+    function dispatch(worker) {
+        if (finished) {
+            return;
+        }
+        if (!queue.length) {
+            worker.current = null;
+            worker.disconnect();
+            if (idle()) {
+                finish();
+            }
+            return;
+        }
+        worker.current = queue.shift();
+        worker.send({test: worker.current});
+    }
+
+    function idle() {
+        return workers.every(function(w) { return w.current === null; });
+    }
+
+    function spawnWorker() {
+        var worker = child_process.fork(__filename, workerArgs(options));
+        worker.current = undefined; // not ready yet
+        worker.on('message', function(message) {
+            if (message.ready) {
+                dispatch(worker);
+                return;
+            }
+            syncWrite('\n' + message.output);
+            cases.push.apply(cases, message.cases);
+            timings[timingKey(message.test)] = message.duration;
+            if (!message.passed) {
+                syncWrite('\n');
+                fail(message.test);
+            }
+            dispatch(worker);
+        });
+        worker.on('exit', function(code) {
+            if (finished || worker.current === null) {
+                return;
+            }
+            if (worker.current === undefined) {
+                // The environment or a superfixture failed to load, which
+                // will happen to every worker.
+                syncWrite('\ntest worker failed to start (exit code ' + code + ')\n');
+                failures.push('<worker startup>');
+                finish();
+                return;
+            }
+            // A test crashed the worker or called process.exit().
+            var test = worker.current;
+            worker.current = null;
+            var error = 'test worker exited with code ' + code;
+            syncWrite('\n' + test + ': ' + error + '\n');
+            cases.push({file: timingKey(test), name: test, passed: false, details: error + '\n'});
+            fail(test);
+            if (queue.length) {
+                spawnWorker();
+            } else if (idle()) {
+                finish();
+            }
+        });
+        workers.push(worker);
+    }
+
+    var jobs = Math.min(options.jobs, options.tests.length);
+    for (var i = 0; i < jobs; ++i) {
+        spawnWorker();
+    }
+}
+
+function main() {
+    if (process.argv.length <= 2) {
+        return usage();
+    }
+
+    var options = parseArgs(process.argv);
+    if (options.worker) {
+        runWorker(options);
+    } else if (options.jobs > 1 && options.tests.length > 1) {
+        runParallel(options);
+    } else {
+        runSerial(options);
+    }
 }
 
 main();
@@ -0,0 +1,331 @@
+"""Runs the imvujs test suites concurrently.
+
+usage:
+    runtests.py [options] [PATH]
+    runtests.py [options] --changed [GIT DIFF ARGS]   (default: HEAD)
+
+PATH restricts every suite to test files matching that glob, relative to
+the repository root.  With --changed, each suite only runs the test files
+that import something in the diff (see bin/select-tests.js).
+
+The build compiles and, unlike a plain s/build, also lints (out/jshint,
+see scons-tools/jshint.py).  Once it finishes, the node tests, the browser
+suites and the expected-failure tests all start at once.
+They share a budget of worker slots, one per CPU by default.  The browser
+suites load from a bin/devserver.py server running in this process, and
+take turns, since both run leprechaun on the same X display.
+Every suite's results are merged into one JUnit XML report and one JSON
+report.
+"""
+
+import fnmatch
+import json
+import multiprocessing
+import optparse
+import os
+import subprocess
+import sys
+import threading
+import time
+from xml.sax.saxutils import escape, quoteattr
+
+import devserver
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+SUPERFIXTURE = os.path.join('tests', 'superfixture.js')
+
+# must match bin/node-runner.js
+NODE_SUMMARY_PREFIX = 'node-runner summary: '
+
+class Budget(object):
+    """A pool of worker slots shared by all stages.  A stage that asks for
+    more slots than exist gets all of them."""
+
+    def __init__(self, slots):
+        self.total = slots
+        self.free = slots
+        self.condition = threading.Condition()
+
+    def acquire(self, n):
+        n = min(n, self.total)
+        with self.condition:
+            while self.free < n:
+                self.condition.wait()
+            self.free -= n
+        return n
+
+    def release(self, n):
+        with self.condition:
+            self.free += n
+            self.condition.notify_all()
+
+def find_tests(directories, suffix, mask):
+    result = []
+    for directory in directories:
+        for dirpath, dirnames, filenames in os.walk(os.path.join(ROOT, directory)):
+            if '.git' in dirnames:
+                dirnames.remove('.git')
+            for filename in filenames:
+                if not filename.lower().endswith(suffix):
+                    continue
+                path = os.path.relpath(os.path.join(dirpath, filename), ROOT)
+                if mask is None or fnmatch.fnmatch(path, mask):
+                    result.append(path)
+    return sorted(result)
+
+def select_changed(tests, diff_args):
+    if not tests:
+        return tests
+    command = [os.path.join(ROOT, 'bin', 'select-tests'),
+               '--superfixture', SUPERFIXTURE,
+               '--git', diff_args] + tests
+    try:
+        output = subprocess.check_output(command, cwd=ROOT)
+    except subprocess.CalledProcessError:
+        # Better to run too much than to skip something.
+        return tests
+    return output.split()
+
+def parse_node_output(output):
+    """Turns the summary line node-runner.js --summary prints last into
+    [(file, test, passed, details)].  Returns [] if there isn't one, e.g.
+    when node-runner crashed."""
+    for line in reversed(output.splitlines()):
+        if line.startswith(NODE_SUMMARY_PREFIX):
+            utf8 = lambda s: s.encode('utf-8')
+            return [(utf8(case['file']), utf8(case['name']), case['passed'], utf8(case['details']))
+                    for case in json.loads(line[len(NODE_SUMMARY_PREFIX):])]
+    return []
+
+class Stage(object):
+    def __init__(self, name, run, depends=()):
+        self.name = name
+        self.run = run
+        self.depends = list(depends)
+        self.done = threading.Event()
+        self.status = 'pending'
+        self.duration = 0.0
+        self.output = ''
+        self.cases = []
+
+    def __call__(self, context):
+        for dependency in self.depends:
+            dependency.done.wait()
+        try:
+            if any(d.status != 'passed' for d in self.depends):
+                self.status = 'skipped'
+                self.output = 'skipped: %s failed\n' % ', '.join(
+                    d.name for d in self.depends if d.status != 'passed')
+                return
+            start = time.time()
+            try:
+                passed, self.output, self.cases = self.run(context)
+            except Exception, e:
+                passed, self.output = False, '%s: %s\n' % (type(e).__name__, e)
+            self.duration = time.time() - start
+            self.status = 'passed' if passed else 'failed'
+        finally:
+            context.report(self)
+            self.done.set()
+
+class Context(object):
+    def __init__(self, options, budget, base_url):
+        self.options = options
+        self.budget = budget
+        self.base_url = base_url
+        self.lock = threading.Lock()
+        # held by whichever browser suite is running leprechaun
+        self.display = threading.Lock()
+
+    def command(self, args, slots=1, env=None):
+        """Runs args while holding `slots` worker slots.  Returns
+        (exit code, combined output)."""
+        slots = self.budget.acquire(slots)
+        try:
+            popen = subprocess.Popen(
+                args, cwd=ROOT, env=env,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output, _ = popen.communicate()
+            return popen.returncode, output
+        finally:
+            self.budget.release(slots)
+
+    def tests(self, directories, suffix):
+        tests = find_tests(directories, suffix, self.options.mask)
+        if self.options.changed is not None:
+            tests = select_changed(tests, self.options.changed)
+        return tests
+
+    def report(self, stage):
+        with self.lock:
+            print '\n==== %s: %s (%.1fs) ====' % (stage.name, stage.status, stage.duration)
+            sys.stdout.write(stage.output)
+            sys.stdout.flush()
+
+def run_build(context):
+    # The build parallelizes itself, so it gets every slot.  Lint stamps
+    # aren't in the default target, so name them alongside it.
+    code, output = context.command(
+        [os.path.join(ROOT, 's', 'build'), 'out', 'out/jshint'], slots=context.budget.total)
+    return code == 0, output, []
+
+def run_node_tests(context):
+    tests = context.tests(['fakes', 'src', 'tests'], '.test.js')
+    if not tests:
+        return True, 'no tests\n', []
+    # Leave a slot for the browser suites, which take turns.
+    slots = context.budget.acquire(max(1, context.budget.total - 1))
+    try:
+        popen = subprocess.Popen(
+            [os.path.join(ROOT, 'bin', 'test'), '--jobs', str(slots), '--keep-going', '--summary',
+             '--superfixture', SUPERFIXTURE] + tests,
+            cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output, _ = popen.communicate()
+    finally:
+        context.budget.release(slots)
+    return popen.returncode == 0, output, parse_node_output(output)
+
+def leprechaun_command():
+    platform = sys.platform
+    binaries = os.path.join(ROOT, 'third-party', 'leprechaun-binaries')
+    env = dict(os.environ, DISPLAY=':9.0')
+    options = []
+    if platform == 'darwin':
+        leprechaun = os.path.join(binaries, 'leprechaun.app', 'Contents', 'MacOS', 'leprechaun')
+    elif platform.startswith('linux'):
+        env['LD_LIBRARY_PATH'] = os.path.join(binaries, 'linux')
+        leprechaun = os.path.join(binaries, 'linux', 'leprechaun')
+        options = ['--disable-gpu', '--disable-setuid-sandbox']
+    else:
+        leprechaun = os.path.join(binaries, 'windows', 'leprechaun.exe')
+    return [leprechaun] + options, env
+
+def browser_stage(suffix, trampoline):
+    def run(context):
+        tests = context.tests(['.'], suffix)
+        if not tests:
+            return True, 'no tests\n', []
+        command, env = leprechaun_command()
+        with context.display:
+            code, output = context.command(
+                command + [context.base_url + 'bin/leprechaun-runner.js',
+                           context.base_url + trampoline] + tests,
+                env=env)
+        cases = [(test, test, code == 0, '') for test in tests]
+        return code == 0, output, cases
+    return run
+
+def run_fail_tests(context):
+    tests = context.tests(['tests'], '.fail.js')
+    results = {}
+
+    def expect_failure(test):
+        code, _ = context.command(
+            [os.path.join(ROOT, 'bin', 'test'), '--superfixture', SUPERFIXTURE, test])
+        results[test] = code != 0
+
+    threads = [threading.Thread(target=expect_failure, args=(test,)) for test in tests]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    output = ''.join(
+        '%s ... %s\n' % (test, 'failed as expected' if results[test] else 'passed incorrectly')
+        for test in tests)
+    cases = [(test, test, results[test], '' if results[test] else 'passed incorrectly')
+             for test in tests]
+    return all(results.values()), output, cases
+
+def write_json(path, stages):
+    json.dump({
+        'stages': [{
+            'name': stage.name,
+            'status': stage.status,
+            'duration': stage.duration,
+            'cases': [{'file': f, 'name': n, 'passed': p, 'details': d}
+                      for f, n, p, d in stage.cases],
+        } for stage in stages],
+    }, open(path, 'wb'), indent=2)
+
+def write_junit(path, stages):
+    out = open(path, 'wb')
+    out.write('<?xml version="1.0" encoding="UTF-8"?>\n<testsuites>\n')
+    for stage in stages:
+        # Stages without per-test results report as a single case.
+        cases = stage.cases or [(stage.name, stage.name, stage.status != 'failed', stage.output)]
+        failures = sum(1 for case in cases if not case[2])
+        out.write('  <testsuite name=%s tests="%d" failures="%d" skipped="%d" time="%.3f">\n' % (
+            quoteattr(stage.name), len(cases), failures,
+            len(cases) if stage.status == 'skipped' else 0, stage.duration))
+        for filename, name, passed, details in cases:
+            out.write('    <testcase classname=%s name=%s>' % (
+                quoteattr(filename or stage.name), quoteattr(name)))
+            if stage.status == 'skipped':
+                out.write('<skipped/>')
+            elif not passed:
+                out.write('<failure>%s</failure>' % escape(details.decode('utf-8', 'replace').encode('utf-8')))
+            out.write('</testcase>\n')
+        out.write('  </testsuite>\n')
+    out.write('</testsuites>\n')
+    out.close()
+
+def main(argv):
+    # Everything after --changed is passed to git diff, options included.
+    diff_args = None
+    if '--changed' in argv:
+        i = argv.index('--changed')
+        argv, diff_args = argv[:i], argv[i + 1:]
+
+    parser = optparse.OptionParser(usage='runtests.py [options] [PATH | --changed [GIT DIFF ARGS]]')
+    parser.add_option('-j', '--jobs', type='int', default=multiprocessing.cpu_count(),
+                      help='worker slots shared by all stages (default: CPU count)')
+    parser.add_option('--port', type='int', default=8001)
+    parser.add_option('--junit', default=os.path.join(ROOT, 'out', 'test-results.xml'))
+    parser.add_option('--json', default=os.path.join(ROOT, 'out', 'test-results.json'))
+    options, args = parser.parse_args(argv[1:])
+
+    options.mask = args[0] if args else None
+    options.changed = None
+    if diff_args is not None:
+        options.changed = ' '.join(diff_args) or 'HEAD'
+
+    budget = Budget(max(2, options.jobs))
+    server = devserver.DevServer(('127.0.0.1', options.port), quiet=True)
+    server.start()
+    context = Context(options, budget, 'http://127.0.0.1:%d/' % (options.port,))
+
+    build = Stage('build', run_build)
+    stages = [
+        build,
+        Stage('node tests', run_node_tests, [build]),
+        Stage('browser tests', browser_stage('.domtest.js', 'bin/test-trampoline.html'), [build]),
+        Stage('browser async tests', browser_stage('.async-test.js', 'bin/async-test-trampoline.html'), [build]),
+        Stage('failure tests', run_fail_tests, [build]),
+    ]
+
+    start = time.time()
+    threads = [threading.Thread(target=stage, args=(context,)) for stage in stages]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+
+    for path in (options.junit, options.json):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+    write_junit(options.junit, stages)
+    write_json(options.json, stages)
+
+    failed = [stage.name for stage in stages if stage.status != 'passed']
+    print '\nFinished in %.1fs; wrote %s and %s' % (time.time() - start, options.junit, options.json)
+    if failed:
+        print '\nFailed: %s' % ', '.join(failed)
+        return 1
+    print '\nSuccess!'
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -30,7 +30,7 @@ function scan_dependencies(rootPath) {
 }
 
 function usage() {
-    console.log("usage: scan_dependencies file.js");
+    console.log("usage: scan_dependencies [--alias NAME=PATH ...] file.js");
     return 1;
 }
 
@@ -38,11 +38,22 @@ function main(argv) {
     var fix_output = require('../src/fix_output.js');
     fix_output.fixConsole(console);
 
-    if (3 !== argv.length) {
-        return usage();
+    var fileName;
+    for (var i = 2; i < argv.length; ++i) {
+        if (argv[i] === '--alias' && (i + 1) < argv.length) {
+            var eq = argv[i + 1].split('=', 2);
+            combine.setAlias(eq[0], eq[1]);
+            ++i;
+        } else if (fileName === undefined) {
+            fileName = argv[i];
+        } else {
+            return usage();
+        }
     }
 
-    var fileName = argv[2];
+    if (fileName === undefined) {
+        return usage();
+    }
 
     scan_dependencies(fileName);
 
@@ -0,0 +1,307 @@
+/*jslint node:true*/
+/*global console*/
+
+var fs      = require('fs');
+var uglify  = require('uglify-js');
+var path    = require('path');
+var child_process = require('child_process');
+var combine = require('./combine.js');
+
+var ROOT = path.resolve(__dirname, '..');
+
+var CACHE_VERSION = 1;
+
+// Changes to these can't break anything a test runs.
+var IGNORED = /(^docs\/|\.md$|\.txt$)/;
+
+// Loaded into every test run by node-runner.js, so if anything they import
+// changes, every test is affected.
+var HARNESS_MODULES = [
+    'src/imvujstest/SyncRunner.js',
+    'src/imvujstest/testglobals.js'
+];
+
+function relative(p) {
+    return path.relative(ROOT, path.resolve(p)).replace(/\\/g, '/');
+}
+
+function statSignature(filename) {
+    try {
+        var st = fs.statSync(filename);
+        return st.mtime.getTime() + ':' + st.size;
+    } catch (e) {
+        return null;
+    }
+}
+
+// Resolves require('./x') and require('../x') calls, which node tests use
+// to load tools like bin/combine.js.  Anything compiled from TypeScript
+// depends on its .ts source too, since that's what shows up in a diff.
+function findRequires(filename, ast) {
+    var result = [];
+    ast.walk(new uglify.TreeWalker(function(node) {
+        if (node instanceof uglify.AST_Call &&
+            node.expression instanceof uglify.AST_SymbolRef &&
+            node.expression.name === 'require' &&
+            node.args.length === 1 &&
+            node.args[0] instanceof uglify.AST_String &&
+            node.args[0].value[0] === '.'
+        ) {
+            var target = path.join(path.dirname(filename), node.args[0].value);
+            if (!/\.js$/.test(target)) {
+                target += '.js';
+            }
+            result.push(target);
+            var ts = target.replace(/\.js$/, '.ts');
+            if (fs.existsSync(ts)) {
+                result.push(ts);
+            }
+        }
+    }));
+    return result;
+}
+
+function scanFile(filename) {
+    if (!/\.js$/.test(filename) || !fs.existsSync(filename)) {
+        return [];
+    }
+
+    var ast;
+    try {
+        ast = uglify.parse(fs.readFileSync(filename, 'utf8'), {filename: filename});
+    } catch (e) {
+        // The test run will report the syntax error; treat it as a leaf.
+        return [];
+    }
+
+    var deps = [];
+    try {
+        var module = combine.readModule(filename, ast);
+        for (var alias in module.deps) {
+            var dep = combine.resolveDependency(module.deps[alias], filename);
+            var bang = dep.indexOf('!');
+            if (bang !== -1) {
+                // plugin!/resource: depend on the resource file
+                dep = dep.substr(bang + 1).replace(/^[\/\\]/, '');
+            }
+            deps.push(dep.replace(/\\/g, '/'));
+        }
+    } catch (e) {
+        // malformed module() call: same as a syntax error
+    }
+    return deps.concat(findRequires(filename, ast));
+}
+
+function DependencyGraph(cachePath) {
+    this.cachePath = cachePath;
+    this.files = {}; // path : {signature, deps}
+    this.dirty = false;
+
+    if (cachePath && fs.existsSync(cachePath)) {
+        try {
+            var cache = JSON.parse(fs.readFileSync(cachePath, 'utf8'));
+            if (cache.version === CACHE_VERSION) {
+                this.files = cache.files;
+            }
+        } catch (e) {
+            // unreadable cache: rebuild it
+        }
+    }
+}
+
+DependencyGraph.prototype.depsOf = function(filename) {
+    var signature = statSignature(filename);
+    var entry = this.files[filename];
+    if (!entry || entry.signature !== signature) {
+        entry = {
+            signature: signature,
+            deps: signature === null ? [] : scanFile(filename)
+        };
+        this.files[filename] = entry;
+        this.dirty = true;
+    }
+    return entry.deps;
+};
+
+// Returns {path: [dependents]} for everything reachable from roots.
+// Only files whose size or mtime changed since the last run are parsed.
+DependencyGraph.prototype.reverse = function(roots) {
+    var dependents = {};
+    var queue = roots.slice();
+    var seen = {};
+    for (var i = 0; i < queue.length; ++i) {
+        var filename = queue[i];
+        if (seen.hasOwnProperty(filename)) {
+            continue;
+        }
+        seen[filename] = true;
+        if (!dependents.hasOwnProperty(filename)) {
+            dependents[filename] = [];
+        }
+
+        var deps = this.depsOf(filename);
+        for (var j = 0; j < deps.length; ++j) {
+            if (!dependents.hasOwnProperty(deps[j])) {
+                dependents[deps[j]] = [];
+            }
+            dependents[deps[j]].push(filename);
+            queue.push(deps[j]);
+        }
+    }
+    return dependents;
+};
+
+DependencyGraph.prototype.save = function() {
+    if (!this.cachePath || !this.dirty) {
+        return;
+    }
+    try {
+        var dir = path.dirname(this.cachePath);
+        if (!fs.existsSync(dir)) {
+            fs.mkdirSync(dir);
+        }
+        fs.writeFileSync(this.cachePath, JSON.stringify({
+            version: CACHE_VERSION,
+            files: this.files
+        }));
+    } catch (e) {
+        console.error('select-tests: could not write ' + this.cachePath + ': ' + e.message);
+    }
+};
+
+function closure(dependents, starts) {
+    var result = {};
+    var stack = starts.slice();
+    while (stack.length) {
+        var filename = stack.pop();
+        if (result.hasOwnProperty(filename)) {
+            continue;
+        }
+        result[filename] = true;
+        stack.push.apply(stack, dependents[filename] || []);
+    }
+    return result;
+}
+
+function forwardClosure(graph, roots) {
+    return Object.keys(graph.reverse(roots));
+}
+
+// Returns the subset of tests (repo-relative paths) affected by changed.
+function selectTests(graph, tests, changed, superfixture) {
+    var global = HARNESS_MODULES.slice();
+    if (superfixture) {
+        global.push(superfixture);
+    }
+    var globalFiles = {};
+    forwardClosure(graph, global).forEach(function(f) {
+        globalFiles[f] = true;
+    });
+
+    var dependents = graph.reverse(tests.concat(global));
+
+    var runAll = false;
+    var relevant = [];
+    changed.forEach(function(f) {
+        if (IGNORED.test(f)) {
+            return;
+        }
+        if (globalFiles.hasOwnProperty(f) || !dependents.hasOwnProperty(f)) {
+            // Either everything depends on it, or it's something outside
+            // the module graph (the runtime, the build, a tool) whose
+            // effect we can't see.
+            runAll = true;
+        }
+        relevant.push(f);
+    });
+
+    if (runAll) {
+        return tests.slice();
+    }
+
+    var affected = closure(dependents, relevant);
+    return tests.filter(function(t) {
+        return affected.hasOwnProperty(t);
+    });
+}
+
+function gitChanges(diffArgs) {
+    function git(args) {
+        return child_process.execFileSync('git', args, {cwd: ROOT, encoding: 'utf8'})
+            .split('\n')
+            .filter(function(line) { return line !== ''; });
+    }
+
+    var changed = git(['diff', '--name-only'].concat(diffArgs));
+    if (diffArgs.indexOf('--cached') === -1) {
+        // New files aren't in the diff until they're staged.
+        changed = changed.concat(git(['ls-files', '--others', '--exclude-standard']));
+    }
+    return changed;
+}
+
+function usage() {
+    console.log("usage: select-tests [--cache FILE] [--superfixture FILE]");
+    console.log("                    (--git 'DIFF ARGS' | --changed FILE ...) TEST.js ...");
+    console.log("");
+    console.log("Prints the given tests that transitively import a changed file.");
+    return 1;
+}
+
+function main(argv) {
+    var fix_output = require('../src/fix_output.js');
+    fix_output.fixConsole(console);
+
+    var cachePath = path.join(ROOT, 'out', '.test-graph.json');
+    var superfixture = null;
+    var changed = [];
+    var diffArgs = null;
+    var tests = [];
+
+    for (var i = 2; i < argv.length; ++i) {
+        var arg = argv[i];
+        if (arg === '--cache' && (i + 1) < argv.length) {
+            cachePath = path.resolve(argv[++i]);
+        } else if (arg === '--superfixture' && (i + 1) < argv.length) {
+            superfixture = relative(argv[++i]);
+        } else if (arg === '--changed' && (i + 1) < argv.length) {
+            changed.push(relative(argv[++i]));
+        } else if (arg === '--git' && (i + 1) < argv.length) {
+            diffArgs = argv[++i].split(/\s+/).filter(function(a) { return a !== ''; });
+        } else if (arg[0] === '-') {
+            return usage();
+        } else {
+            tests.push(arg);
+        }
+    }
+
+    if (diffArgs === null && changed.length === 0) {
+        return usage();
+    }
+    if (diffArgs !== null) {
+        changed = changed.concat(gitChanges(diffArgs));
+    }
+
+    // Work in repo-relative paths but print the tests as we were given them.
+    var byRelative = {};
+    tests.forEach(function(t) {
+        byRelative[relative(t)] = t;
+    });
+
+    process.chdir(ROOT);
+    var graph = new DependencyGraph(cachePath);
+    var selected = selectTests(graph, Object.keys(byRelative), changed, superfixture);
+    graph.save();
+
+    selected.forEach(function(t) {
+        console.log(byRelative[t]);
+    });
+    return 0;
+}
+
+exports.DependencyGraph = DependencyGraph;
+exports.selectTests = selectTests;
+
+if (null === module.parent) {
+    process.exit(main(process.argv));
+}
@@ -1,21 +1,66 @@
+import hashlib
 import os.path
+import SCons.Action
+import SCons.Errors
 from SCons.Builder import Builder
 
+# Flags that make Closure treat its inputs as one program (wrapping,
+# reordering or splitting them), even under WHITESPACE_ONLY.
+WHOLE_PROGRAM_FLAGS = (
+    '--chunk',
+    '--module',
+    '--output_wrapper',
+    '--output_wrapper_file',
+    '--dependency_mode',
+    '--entry_point',
+    '--manage_closure_dependencies',
+    '--only_closure_dependencies',
+    '--process_common_js_modules',
+    '--isolation_mode',
+)
+
+def compiles_files_separately(flags):
+    """True if compiling several files with flags gives the same code as
+    compiling each on its own and concatenating the results."""
+    level = None
+    for i, flag in enumerate(flags):
+        name, _, value = flag.partition('=')
+        if name == '--compilation_level':
+            level = value or (flags[i + 1] if i + 1 < len(flags) else None)
+        elif name in WHOLE_PROGRAM_FLAGS:
+            return False
+    return level == 'WHITESPACE_ONLY'
+
+def concatenate_fragments(target, source, env):
+    output = open(str(target[0]), 'wb')
+    for fragment in source:
+        code = fragment.get_contents().rstrip()
+        output.write(code)
+        # Closure ends statements with one of these; anything else would
+        # run on into the next file.
+        if code and code[-1] not in ';}':
+            output.write(';')
+        output.write('\n')
+    output.close()
+
 def generate(env):
     def depend_on_closure_compiler(target, source, env):
         env.Depends(target, env['CLOSURE_COMPILER'])
         return target, source
 
     if env['PLATFORM'] == 'cygwin':
-        ClosureCompiler = Builder(
-            action='$JAVA $JAVAFLAGS -jar `cygpath -w $CLOSURE_COMPILER` $CLOSURE_FLAGS --js_output_file $TARGET $SOURCES',
-            emitter=depend_on_closure_compiler
-        )
+        compiler = '$JAVA $JAVAFLAGS -jar `cygpath -w $CLOSURE_COMPILER` $CLOSURE_FLAGS'
     else:
-        ClosureCompiler = Builder(
-            action='$JAVA $JAVAFLAGS -jar $CLOSURE_COMPILER $CLOSURE_FLAGS --js_output_file $TARGET $SOURCES',
-            emitter=depend_on_closure_compiler
-        )
+        compiler = '$JAVA $JAVAFLAGS -jar $CLOSURE_COMPILER $CLOSURE_FLAGS'
+
+    ClosureCompilerBuilder = Builder(
+        action=compiler + ' --js_output_file $TARGET $SOURCES',
+        emitter=depend_on_closure_compiler
+    )
+    ClosureChunksBuilder = Builder(
+        action=compiler + ' $CLOSURE_CHUNK_FLAGS --chunk_output_path_prefix $CLOSURE_CHUNK_PREFIX $SOURCES',
+        emitter=depend_on_closure_compiler
+    )
 
     closure = os.path.join(
         os.path.dirname(__file__),
@@ -27,8 +72,83 @@ def generate(env):
 
     env['JAVA'] = 'java'
     env['CLOSURE_COMPILER'] = closure
+    # Set to False to compile WHITESPACE_ONLY targets in one piece.
+    env['CLOSURE_FRAGMENTS'] = True
+    env['CLOSURE_FRAGMENT_DIR'] = 'out/closure'
     env.Append(
-        BUILDERS={'ClosureCompiler':ClosureCompiler})
+        BUILDERS={
+            'ClosureCompilerBuilder': ClosureCompilerBuilder,
+            'ClosureChunksBuilder': ClosureChunksBuilder,
+            'ConcatenateClosureFragments': Builder(
+                action=SCons.Action.Action(concatenate_fragments, cmdstr='Concatenating $TARGET'))})
+
+    # Targets built with the same flags share fragments: fragment path :
+    # nodes
+    fragments = {}
+
+    def ClosureCompiler(env, target, source, **kw):
+        """Compiles source into target with $CLOSURE_FLAGS.
+
+        If the flags compile each file on its own, as WHITESPACE_ONLY
+        does, each source is compiled into a fragment under
+        $CLOSURE_FRAGMENT_DIR, and target is the fragments concatenated.
+        Then editing one source recompiles only that source.  Cross-file
+        checks still need a target built in one piece, which imvu.min.js
+        is."""
+        overrides = env.Override(kw)
+        flags = overrides.subst('$CLOSURE_FLAGS').split()
+        if not overrides['CLOSURE_FRAGMENTS'] or not compiles_files_separately(flags):
+            return env.ClosureCompilerBuilder(target, source, **kw)
+
+        # Fragments compiled with different flags must not collide.
+        flags_dir = hashlib.md5(' '.join(flags)).hexdigest()[:8]
+        nodes = []
+        for node in env.arg2nodes(source, env.fs.File):
+            fragment = os.path.join(
+                overrides.subst('$CLOSURE_FRAGMENT_DIR'),
+                flags_dir,
+                node.get_path(env.Dir('#')))
+            if fragment not in fragments:
+                fragments[fragment] = env.ClosureCompilerBuilder(fragment, node, **kw)
+            nodes += fragments[fragment]
+        return env.ConcatenateClosureFragments(target, nodes)
+
+    env.AddMethod(ClosureCompiler)
+
+    def ClosureChunks(env, prefix, chunks, **kw):
+        """Compiles chunks, a list of (name, sources) or (name, sources,
+        names of the chunks it depends on), in one Closure run that writes
+        each chunk to prefix + name + '.js'.  Chunks that don't list their
+        dependencies depend on the first chunk, the core.  A page loads the
+        core, and loads another chunk, after the ones it depends on, once
+        it needs that chunk's code.  Returns the chunks' targets in order."""
+        core = chunks[0][0]
+        flags = []
+        sources = []
+        chunk_of = {}
+        for chunk in chunks:
+            name = chunk[0]
+            files = env.arg2nodes(chunk[1], env.fs.File)
+            if len(chunk) > 2:
+                dependencies = chunk[2]
+            else:
+                dependencies = [] if name == core else [core]
+            for node in files:
+                if node in chunk_of:
+                    raise SCons.Errors.UserError(
+                        '%s is in both chunk %s and chunk %s' % (node, chunk_of[node], name))
+                chunk_of[node] = name
+            # name:number of files[:dependency,...]
+            flags += ['--chunk', ':'.join([name, str(len(files))] + ([','.join(dependencies)] if dependencies else []))]
+            sources += files
+        targets = [prefix + chunk[0] + '.js' for chunk in chunks]
+        return env.ClosureChunksBuilder(
+            targets, sources,
+            CLOSURE_CHUNK_FLAGS=flags,
+            CLOSURE_CHUNK_PREFIX=prefix,
+            **kw)
+
+    env.AddMethod(ClosureChunks)
 
 def exists(_env):
     return True
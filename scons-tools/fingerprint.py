@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+import shutil
+import SCons.Action
+import SCons.Errors
+from SCons.Builder import Builder
+
+def exists(_env):
+    return True
+
+def fingerprinted_name(name, contents, length):
+    """foo/bar.js -> foo/bar.<hash of contents>.js"""
+    root, ext = os.path.splitext(name)
+    return '%s.%s%s' % (root, hashlib.md5(contents).hexdigest()[:length], ext)
+
+def write_fingerprinted(target, source, env):
+    manifest_path = str(target[0])
+    directory = os.path.dirname(manifest_path)
+    root = env.Dir(env['FINGERPRINT_ROOT']).abspath
+
+    try:
+        previous = json.load(open(manifest_path, 'rb'))
+    except (IOError, ValueError):
+        previous = {}
+
+    manifest = {}
+    for node in source:
+        name = os.path.relpath(node.abspath, root).replace('\\', '/')
+        if name.startswith('../'):
+            raise SCons.Errors.UserError('%s is not under $FINGERPRINT_ROOT' % (node,))
+        fingerprinted = fingerprinted_name(name, node.get_contents(), env['FINGERPRINT_LENGTH'])
+        path = os.path.join(directory, fingerprinted)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        shutil.copyfile(str(node), path)
+        manifest[name] = fingerprinted
+
+    # Deployed copies stay around for clients that still have an old
+    # manifest, but the build directory only needs the current ones.
+    for name, fingerprinted in previous.items():
+        path = os.path.join(directory, fingerprinted)
+        if manifest.get(name) != fingerprinted and os.path.exists(path):
+            os.remove(path)
+
+    output = open(manifest_path, 'wb')
+    json.dump(manifest, output, indent=2, separators=(',', ': '), sort_keys=True)
+    output.write('\n')
+    output.close()
+
+def generate(env):
+    env['FINGERPRINT_ROOT'] = '#out'
+    env['FINGERPRINT_LENGTH'] = 10
+
+    def keep_manifest(target, source, env):
+        # The old manifest says which copies to delete, so SCons mustn't
+        # remove it before the build.
+        env.Precious(target)
+        env.Clean(target, target[0].dir)
+        return target, source
+
+    # env.Fingerprint('out/fingerprinted/manifest.json', sources) copies each
+    # source to a name with its contents' hash in it, next to the manifest,
+    # and writes a manifest mapping each source's path under
+    # $FINGERPRINT_ROOT to its copy's.  A copy's name changes whenever its
+    # contents do, so it can be cached forever.
+    env['BUILDERS']['Fingerprint'] = Builder(
+        action=SCons.Action.Action(
+            write_fingerprinted,
+            cmdstr='Fingerprinting $SOURCES',
+            varlist=['FINGERPRINT_ROOT', 'FINGERPRINT_LENGTH']),
+        emitter=keep_manifest)
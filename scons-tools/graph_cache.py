@@ -0,0 +1,169 @@
+import atexit
+import glob
+import hashlib
+import json
+import os
+import sys
+
+# Files whose contents determine the shape of the build graph.  If any of
+# these change, the snapshot is stale no matter what the timestamps say.
+GRAPH_INPUTS = [
+    'SConstruct',
+    'bin/SConstruct',
+]
+GRAPH_INPUT_GLOBS = [
+    'scons-tools/*.py',
+]
+
+# Sources of the bin/SConstruct build, which s/build runs before the main
+# build.  The main graph only sees their output, bin/combine.js.
+EXTRA_WATCHED_GLOBS = [
+    'bin/*.ts',
+]
+
+def graph_inputs(root):
+    paths = list(GRAPH_INPUTS)
+    for pattern in GRAPH_INPUT_GLOBS:
+        paths.extend(sorted(
+            os.path.relpath(p, root)
+            for p in glob.glob(os.path.join(root, pattern))))
+    return paths
+
+def graph_key(root, arguments, targets):
+    digest = hashlib.md5()
+    for path in graph_inputs(root):
+        digest.update(path + '\0')
+        try:
+            digest.update(open(os.path.join(root, path), 'rb').read())
+        except IOError:
+            digest.update('<missing>')
+        digest.update('\0')
+    for key, value in sorted(arguments.items()):
+        digest.update('%s=%s\0' % (key, value))
+    for target in targets:
+        digest.update('target:%s\0' % (target,))
+    return digest.hexdigest()
+
+def stat_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+def parse_command_line(args):
+    """Splits scons command-line arguments the same way SCons does into
+    ARGUMENTS and COMMAND_LINE_TARGETS.  Returns None if any option is
+    present, since options like -c or -n change what a build means."""
+    arguments = {}
+    targets = []
+    for arg in args:
+        if arg.startswith('-'):
+            return None
+        if '=' in arg:
+            key, value = arg.split('=', 1)
+            arguments[key] = value
+        else:
+            targets.append(arg)
+    return arguments, targets
+
+def snapshot_is_current(root, snapshot, args):
+    parsed = parse_command_line(args)
+    if parsed is None:
+        return False
+    arguments, targets = parsed
+
+    try:
+        data = json.load(open(os.path.join(root, snapshot), 'rb'))
+    except (IOError, ValueError):
+        return False
+
+    if data.get('key') != graph_key(root, arguments, targets):
+        return False
+
+    for path, signature in data['files'].iteritems():
+        if stat_signature(os.path.join(root, path)) != signature:
+            return False
+    return True
+
+def generate(env):
+    import SCons.Node.FS
+    import SCons.Script
+
+    def collect_files(roots):
+        seen = set()
+        files = set()
+        stack = list(roots)
+        while stack:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            if isinstance(node, SCons.Node.FS.File):
+                files.add(node)
+            stack.extend(node.children())
+        return files
+
+    def GraphSnapshot(env, snapshot):
+        """Records the evaluated build graph, including scanned implicit
+        dependencies, into `snapshot` once the build succeeds.  s/build
+        consults the snapshot with `python scons-tools/graph_cache.py` and
+        skips running SCons altogether if nothing in it has changed."""
+        root = env.Dir('#').abspath
+        snapshot_path = os.path.join(root, snapshot)
+
+        def write_snapshot():
+            from SCons.Script import Main
+
+            if (Main.exit_status
+                or SCons.Script.GetBuildFailures()
+                or env.GetOption('clean')
+                or env.GetOption('no_exec')
+                or env.GetOption('question')
+                or env.GetOption('interactive')
+                or env.GetOption('watch')):
+                if os.path.exists(snapshot_path):
+                    os.remove(snapshot_path)
+                return
+
+            roots = [
+                env.Entry(t) if isinstance(t, basestring) else t
+                for t in SCons.Script.BUILD_TARGETS]
+            nodes = collect_files(roots)
+            paths = set(f.abspath for f in nodes)
+            # A directory's mtime changes when files are added or removed,
+            # which matters when the SConstruct globs for sources.  Only
+            # subdirectories count: SCons itself rewrites .sconsign.dblite
+            # in the root on every build.
+            paths.update(
+                f.dir.abspath for f in nodes
+                if not f.has_builder() and f.dir.abspath.startswith(root + os.sep))
+            for pattern in EXTRA_WATCHED_GLOBS:
+                paths.update(glob.glob(os.path.join(root, pattern)))
+            for path in graph_inputs(root):
+                paths.add(os.path.join(root, path))
+
+            files = {}
+            for path in paths:
+                signature = stat_signature(path)
+                if signature is not None:
+                    files[os.path.relpath(path, root)] = signature
+
+            key = graph_key(
+                root,
+                SCons.Script.ARGUMENTS,
+                SCons.Script.COMMAND_LINE_TARGETS)
+            json.dump({'key': key, 'files': files}, open(snapshot_path, 'wb'))
+
+        atexit.register(write_snapshot)
+
+    env.AddMethod(GraphSnapshot)
+
+def exists(_env):
+    return True
+
+if __name__ == '__main__':
+    # usage: graph_cache.py <root> <snapshot> [scons arguments...]
+    # Exits 0 if the snapshot is current and the build can be skipped.
+    root, snapshot = sys.argv[1:3]
+    sys.exit(0 if snapshot_is_current(root, snapshot, sys.argv[3:]) else 1)
@@ -0,0 +1,76 @@
+import os
+import zlib
+import SCons.Action
+from SCons.Builder import Builder
+
+def exists(_env):
+    return True
+
+def generate(env):
+    env['JSHINT'] = env.File(
+        os.path.join(
+            os.path.dirname(__file__),
+            '..',
+            'third-party',
+            'jshint',
+            'bin',
+            'jshint'))
+    env['JSHINTRC'] = env.File('#.jshintrc')
+    env['JSHINT_STAMP_DIR'] = 'out/jshint'
+
+    def batch_key(action, env, target, source):
+        # One batch per job slot, so out-of-date files are linted a few
+        # node processes at a time instead of one process per file.  Files
+        # are assigned by a stable hash of their path.
+        jobs = env.GetOption('num_jobs') or 1
+        return (id(action), id(env), zlib.crc32(str(source[0])) % jobs)
+
+    lint = SCons.Action.Action(
+        '$NODEJS $NODEJSFLAGS $JSHINT --config $JSHINTRC $SOURCES')
+
+    def lint_and_stamp(target, source, env):
+        # targets= below tells SCons to prepare (delete) only the stamps of
+        # the out-of-date files in the batch, so the missing stamps are
+        # exactly the files to lint.  The stamps are written from Python
+        # rather than with touch, which the Windows builds don't have.
+        changed = [
+            (t, s) for t, s in zip(target, source)
+            if not os.path.exists(t.get_abspath())]
+        if not changed:
+            return 0
+        targets = [t for t, _ in changed]
+        status = lint(targets, [s for _, s in changed], env)
+        if status:
+            return status
+        for t in targets:
+            open(t.get_abspath(), 'w').close()
+        return 0
+
+    action = SCons.Action.Action(
+        lint_and_stamp,
+        strfunction=None,
+        batch_key=batch_key,
+        targets='$CHANGED_TARGETS')
+
+    def depend_on_config(target, source, env):
+        env.Depends(target, env['JSHINT'])
+        env.Depends(target, env['JSHINTRC'])
+        return target, source
+
+    env['BUILDERS']['JSHintStamp'] = Builder(
+        action=action,
+        emitter=depend_on_config)
+
+    def JSHint(env, sources):
+        """Lints each source file into its own stamp target under
+        $JSHINT_STAMP_DIR, so a file is only re-linted when its contents
+        or the jshint configuration change."""
+        stamps = []
+        for source in env.arg2nodes(sources, env.fs.File):
+            stamp = os.path.join(
+                env.subst('$JSHINT_STAMP_DIR'),
+                source.get_path(env.Dir('#')) + '.stamp')
+            stamps += env.JSHintStamp(stamp, source)
+        return stamps
+
+    env.AddMethod(JSHint)
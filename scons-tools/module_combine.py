@@ -1,19 +1,66 @@
+import json
 import os.path
 from SCons.Scanner import Scanner
 from SCons.Builder import Builder
 import subprocess
 
+DEPFILE_VERSION = 2
+
+def read_depfile(depfile, roots, aliases):
+    """Returns the files a previous combine of roots read, as recorded in
+    its depfile, or None if the depfile is missing, any of them has
+    changed since, or an import that didn't resolve then exists now."""
+    try:
+        data = json.load(open(depfile, 'rb'))
+    except (IOError, ValueError):
+        return None
+    if data.get('version') != DEPFILE_VERSION:
+        return None
+    if map(os.path.normpath, data.get('roots', [])) != map(os.path.normpath, roots):
+        return None
+    if data.get('aliases') != dict((k, str(v)) for k, v in aliases.items()):
+        return None
+
+    files = data.get('files', {})
+    for path, (mtime, size) in files.items():
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        # combine records whole milliseconds
+        if st.st_size != size or abs(st.st_mtime * 1000 - mtime) >= 1:
+            return None
+    for path in data.get('missing', []):
+        if os.path.exists(path):
+            return None
+    return files.keys()
+
 def generate(env):
+    def depfile_for(target, env):
+        return str(target) + env.subst('$MODULE_DEPFILE_SUFFIX')
+
     def depend_on_combiner(target, source, env):
         env.Depends(target, env['MODULE_COMBINE'])
         env.Depends(target, env['MODULE_SCAN'])
+        # combine writes the depfile while building target, so it's a side
+        # effect as well as something to clean.
+        depfile = depfile_for(target[0], env)
+        env.SideEffect(depfile, target)
+        env.Clean(target, depfile)
 
         return target, source
 
     def combine(target, source, env, for_signature):
         aliases = ["--alias %s=%s" % (key, value) for key, value in env['MODULE_ALIASES'].items()]
         module_combine = os.path.relpath(env.subst('$MODULE_COMBINE'), env['MODULE_COMBINE'].cwd or os.getcwd())
-        return '$NODEJS ' + module_combine + ' ' + ' '.join(aliases) + ' $SOURCE > $TARGET'
+        return '$NODEJS ' + module_combine + ' $MODULE_COMBINE_FLAGS --depfile ${TARGET}$MODULE_DEPFILE_SUFFIX ' + ' '.join(aliases) + ' --out $TARGET $SOURCE'
+
+    def combine_chunks(target, source, env, for_signature):
+        aliases = ["--alias %s=%s" % (key, value) for key, value in env['MODULE_ALIASES'].items()]
+        module_combine = os.path.relpath(env.subst('$MODULE_COMBINE'), env['MODULE_COMBINE'].cwd or os.getcwd())
+        entries = ['${SOURCES[%d]}=${TARGETS[%d]}' % (i, i + 1) for i in range(len(source))]
+        return ('$NODEJS ' + module_combine + ' $MODULE_COMBINE_FLAGS --depfile ${TARGET}$MODULE_DEPFILE_SUFFIX ' +
+                ' '.join(aliases) + ' --min-shared $MODULE_MIN_SHARED --shared-chunk $TARGET ' + ' '.join(entries))
     
     path = os.path.join(
         os.path.relpath(os.path.dirname(__file__)),
@@ -31,12 +78,24 @@ def generate(env):
     )
     env['MODULE_SCAN'] = env.File(path)
     env['MODULE_ALIASES'] = {}
+    # e.g. ['--jobs', 'auto'] to parse a large bundle's modules in parallel
+    env['MODULE_COMBINE_FLAGS'] = []
+    # combine lists the files it read in $TARGET$MODULE_DEPFILE_SUFFIX
+    env['MODULE_DEPFILE_SUFFIX'] = '.deps.json'
+    # CombinedChunks moves modules at least this many bundles include into
+    # the shared chunk
+    env['MODULE_MIN_SHARED'] = 2
 
-    def scan_module_dependencies(node, env, path):
+    def scan_sources(root, env):
         # TODO: maybe we should pass the list of aliases and loaders to the tool rather than parsing the @ here
         import os
         module_scan = os.path.relpath(env.subst('$MODULE_SCAN'), env['MODULE_SCAN'].cwd or os.getcwd())
-        cmd = [env.subst('$NODEJS'), module_scan, str(node)]
+        cmd = [env.subst('$NODEJS'), module_scan]
+        # Aliases are followed like combine follows them, so the result
+        # matches what its depfile will say.
+        for key, value in env['MODULE_ALIASES'].items():
+            cmd.extend(['--alias', '%s=%s' % (key, value)])
+        cmd.append(root)
         popen = subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE)
@@ -57,8 +116,33 @@ def generate(env):
         paths = filter(None, stdout.split('\n'))
         paths = [path.replace('\\', '/') for path in paths]
         paths = filter(lambda s: '!' not in s, paths)
-        paths = filter(None, map(resolveAlias, paths))
-        return map(env.File, paths)
+        return filter(None, map(resolveAlias, paths))
+
+    # CombinedChunks' targets all share one scan: (first target, roots,
+    # depfile mtime) : paths
+    scanned = {}
+
+    def scan_module_dependencies(node, env, path):
+        # node is a combined output.  Until one of the files the last
+        # combine read changes, its depfile says what they all are, so
+        # the modules don't have to be parsed a second time.
+        first = node.get_executor().get_all_targets()[0]
+        roots = [str(source) for source in node.sources]
+        depfile = depfile_for(first, env)
+        try:
+            key = (str(first), tuple(roots), os.stat(depfile).st_mtime)
+        except OSError:
+            key = (str(first), tuple(roots), None)
+        if key not in scanned:
+            paths = read_depfile(depfile, roots, env['MODULE_ALIASES'])
+            if paths is None:
+                paths = []
+                for root in roots:
+                    paths.extend(scan_sources(root, env))
+            # The order has to be stable, since SCons compares dependencies
+            # with the last build's by position.
+            scanned[key] = sorted(set(path.replace('\\', '/') for path in paths))
+        return map(env.File, scanned[key])
 
     ModuleScanner = Scanner(
         function=scan_module_dependencies,
@@ -67,10 +151,26 @@ def generate(env):
     CombinedModule = Builder(
         generator=combine,
         emitter=depend_on_combiner,
-        source_scanner=ModuleScanner)
+        target_scanner=ModuleScanner)
+    CombinedChunksBuilder = Builder(
+        generator=combine_chunks,
+        emitter=depend_on_combiner,
+        target_scanner=ModuleScanner)
     env.Append(
         BUILDERS={
-            'CombinedModule': CombinedModule})
+            'CombinedModule': CombinedModule,
+            'CombinedChunksBuilder': CombinedChunksBuilder})
+
+    def CombinedChunks(env, chunk, bundles):
+        """Combines each (target, root) pair in bundles, like CombinedModule,
+        except that the modules shared by at least $MODULE_MIN_SHARED of
+        them go into one chunk, which the others import.  Returns the chunk
+        and then the bundles."""
+        targets = [chunk] + [target for target, _ in bundles]
+        roots = [root for _, root in bundles]
+        return env.CombinedChunksBuilder(targets, roots)
+
+    env.AddMethod(CombinedChunks)
 
 def exists(_env):
     return True
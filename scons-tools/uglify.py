@@ -1,9 +1,21 @@
 import os.path
+import SCons.Action
 from SCons.Builder import Builder
 
 def exists(env):
     return True
 
+def concatenate_fragments(target, source, env):
+    output = open(str(target[0]), 'wb')
+    for fragment in source:
+        code = fragment.get_contents().rstrip()
+        output.write(code)
+        # Keep the next fragment from continuing this one's last statement.
+        if code and code[-1] not in ';}':
+            output.write(';')
+        output.write('\n')
+    output.close()
+
 def generate(env):
     env['UGLIFYJS'] = env.File(
         os.path.join(
@@ -14,6 +26,28 @@ def generate(env):
             'bin',
             'uglifyjs'))
     env['UGLIFYJSFLAGS'] = []
+    env['UGLIFYJS_FRAGMENT_DIR'] = 'out/uglify'
     env['BUILDERS']['UglifyJS'] = Builder(
         action='$NODEJS $NODEJSFLAGS $UGLIFYJS $SOURCES -o $TARGET $UGLIFYJSFLAGS')
+    env['BUILDERS']['ConcatenateFragments'] = Builder(
+        action=SCons.Action.Action(concatenate_fragments, cmdstr='Concatenating $TARGET'))
+
+    def UglifyJSFragments(env, target, sources):
+        """Minifies each source into its own fragment under
+        $UGLIFYJS_FRAGMENT_DIR and concatenates the fragments into target.
+
+        The fragments build in parallel under -j, and since each one's
+        signature covers its source's contents and the expanded
+        $UGLIFYJSFLAGS, editing one file re-minifies only that file.
+        Unless top-level names are mangled, the result matches minifying
+        the concatenation, apart from compressor passes that would have
+        looked across files."""
+        fragments = []
+        for source in env.arg2nodes(sources, env.fs.File):
+            fragment = os.path.join(
+                env.subst('$UGLIFYJS_FRAGMENT_DIR'),
+                source.get_path(env.Dir('#')))
+            fragments += env.UglifyJS(fragment, source)
+        return env.ConcatenateFragments(target, fragments)
 
+    env.AddMethod(UglifyJSFragments)
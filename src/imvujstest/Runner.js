@@ -66,6 +66,8 @@ module({
                     } else {
                         self.runTest(self.superFixtures, test, function (failed) {
                             if (failed) {
+                                // so the next suite in this process starts clean
+                                self.allTests = [];
                                 reporter.endTest(test, false, failed.stack, failed.e);
                                 reporter.endSuite(false);
                                 onComplete(false);
@@ -83,8 +83,42 @@
         paths: {}
     };
 
-    module.setRoot = function (root) {
+    // name : fingerprinted name, both relative to the root
+    var manifest = {};
+
+    function addToManifest(entries) {
+        for (var name in entries) {
+            if (entries.hasOwnProperty(name)) {
+                manifest[name] = entries[name];
+            }
+        }
+    }
+
+    function fingerprintedUrl(url, baseUrl) {
+        var end = url.indexOf('?');
+        if (end === -1) {
+            end = url.length;
+        }
+        var prefix = (baseUrl && url.indexOf(baseUrl) === 0) ? baseUrl : '';
+        var name = url.slice(prefix.length, end);
+        if (!manifest.hasOwnProperty(name)) {
+            return url;
+        }
+        return prefix + manifest[name] + url.slice(end);
+    }
+
+    // Files listed in the manifest load from their fingerprinted names,
+    // which change with their contents, so they can be cached forever.
+    var load = requirejs.load;
+    requirejs.load = function (context, moduleName, url) {
+        return load.call(this, context, moduleName, fingerprintedUrl(url, context.config.baseUrl));
+    };
+
+    module.setRoot = function (root, rootManifest) {
         requireConfig.baseUrl = root;
+        if ('undefined' !== typeof rootManifest) {
+            addToManifest(rootManifest);
+        }
         require.config(requireConfig);
     };
 
@@ -119,6 +153,10 @@
             requireConfig.baseUrl = config.baseUrl;
         }
 
+        if ('undefined' !== typeof config.manifest) {
+            addToManifest(config.manifest);
+        }
+
         require.config(requireConfig);
     };
 
@@ -0,0 +1,42 @@
+module({
+    Runner: '../src/imvujstest/Runner.js'
+}, function(imports) {
+    fixture('Runner', function() {
+        this.setUp(function() {
+            var ran = this.ran = [];
+            this.runner = new imports.Runner(function(superFixtures, test, continuation) {
+                ran.push(test.name);
+                continuation(test.name === 'fails' ? {stack: 'stack', e: new Error('fails')} : false);
+            });
+            this.reporter = {
+                startSuite: function() {},
+                endSuite: function() {},
+                startTest: function() {},
+                endTest: function() {},
+                skipTest: function() {}
+            };
+            this.results = [];
+            this.onComplete = this.results.push.bind(this.results);
+        });
+
+        test('a passed suite leaves no tests for the next one', function() {
+            this.runner.test('passes', function() {});
+            this.runner.run_all('first.js', this.reporter, this.onComplete);
+            this.runner.test('also passes', function() {});
+            this.runner.run_all('second.js', this.reporter, this.onComplete);
+
+            assert.deepEqual([true, true], this.results);
+            assert.deepEqual(['passes', 'also passes'], this.ran);
+        });
+
+        test('a failed suite leaves no tests for the next one', function() {
+            this.runner.test('fails', function() {});
+            this.runner.run_all('first.js', this.reporter, this.onComplete);
+            this.runner.test('passes', function() {});
+            this.runner.run_all('second.js', this.reporter, this.onComplete);
+
+            assert.deepEqual([false, true], this.results);
+            assert.deepEqual(['fails', 'passes'], this.ran);
+        });
+    });
+});
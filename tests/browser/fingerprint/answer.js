@@ -0,0 +1,3 @@
+module({}, function(imports) {
+    return 'original';
+});
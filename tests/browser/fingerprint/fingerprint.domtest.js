@@ -0,0 +1,13 @@
+module.config({
+    manifest: {
+        '/tests/browser/fingerprint/answer.js': '/tests/browser/fingerprint/answer.0123456789.js'
+    }
+});
+
+module({
+    answer: '/tests/browser/fingerprint/answer.js'
+}, function(imports) {
+    test('modules in the manifest load from their fingerprinted names', function() {
+        assert.equal('fingerprinted', imports.answer);
+    });
+});
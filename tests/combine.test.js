@@ -3,6 +3,7 @@ module({}, function(imports) {
     var path = require('path');
     var combine = require('../bin/combine.js');
     var fs = require('fs');
+    var child_process = require('child_process');
 
     var expected = [
         'module({}, function($module$deferred) {',
@@ -90,6 +91,13 @@ module({}, function(imports) {
             assert.equal("ES5: Module '" + path.normalize('combine/missing.js') + "' is missing, referred to by: combine/has-missing.js", exc.message);
         });
 
+        test('combine reports circular dependencies', function() {
+            var exc = assert.throws(combine.ScriptError, function() {
+                combine.combine(combine.readModules('combine/cycle/root.js'), 'combine/cycle/root.js');
+            });
+            assert.equal("ES5: Circular dependency: " + ['combine/cycle/a.js', 'combine/cycle/b.js', 'combine/cycle/a.js'].map(path.normalize).join(' -> '), exc.message);
+        });
+
         test('readModules returns module dependencies', function() {
             var _ref = combine.readModules(path.normalize('combine/d.js'));
             var modules = _ref.resolved;
@@ -161,6 +169,15 @@ module({}, function(imports) {
                 beautify: true
             });
             assert.equal(expected,  actual + '\n');
+
+            var streamed = [];
+            combine.streamCombine(combine.readModules(toCombine), toCombine, {
+                write: function (text) {
+                    streamed.push(text);
+                },
+                close: function () {}
+            });
+            assert.equal(expected, streamed.join(''));
         };
         test('simple', function () {
             this.expectCombine('combine/deferred-alias/simple.combined.js', 'combine/deferred-alias/simple.js');
@@ -184,4 +201,143 @@ module({}, function(imports) {
             this.expectCombine('combine/custom-loaders/relative.combined.js', 'combine/custom-loaders/relative.js');
         });
     });
+
+    fixture('shared chunks', function () {
+        this.setUp(function() {
+            this.cwd = process.cwd();
+            process.chdir(path.dirname(__filename));
+            this.roots = ['combine/chunks/one.js', 'combine/chunks/two.js', 'combine/chunks/three.js'].map(path.normalize);
+            this.chunks = function (minShared) {
+                return combine.combineChunks(
+                    combine.readAllModules(this.roots),
+                    this.roots,
+                    ['shared.combined.js', 'shared.combined.js', 'shared.combined.js'],
+                    minShared);
+            };
+        });
+
+        this.tearDown(function() {
+            process.chdir(this.cwd);
+        });
+
+        test('modules in at least two bundles are shared', function () {
+            var chunks = this.chunks(2);
+            assert.deepEqual(
+                ['combine/chunks/one.js', 'combine/chunks/shared.js', 'combine/chunks/leaf.js', 'combine/chunks/only-one.js'].map(path.normalize),
+                chunks.shared.modules);
+            assert.deepEqual(
+                [[], ['combine/chunks/two.js'], ['combine/chunks/three.js']].map(function (paths) {
+                    return paths.map(path.normalize);
+                }),
+                chunks.entries.map(function (entry) {
+                    return entry.modules;
+                }));
+        });
+
+        test('entries load shared modules from the chunk', function () {
+            var chunks = this.chunks(2);
+            var expect = function (expected, bundle) {
+                assert.equal(fs.readFileSync(expected, 'utf-8'), combine.gen_code(bundle.ast, {beautify: true}) + '\n');
+            };
+            expect('combine/chunks/shared.combined.js', chunks.shared);
+            expect('combine/chunks/one.combined.js', chunks.entries[0]);
+            expect('combine/chunks/two.combined.js', chunks.entries[1]);
+            expect('combine/chunks/three.combined.js', chunks.entries[2]);
+        });
+
+        test('nothing is shared above the threshold', function () {
+            var chunks = this.chunks(4);
+            assert.deepEqual([], chunks.shared.modules);
+            chunks.entries.forEach(function (entry, i) {
+                assert.equal(
+                    combine.gen_code(chunks.standalone[i].ast, {beautify: true}),
+                    combine.gen_code(entry.ast, {beautify: true}));
+            });
+        });
+    });
+
+    fixture('parallel reading', function () {
+        this.setUp(function() {
+            this.cwd = process.cwd();
+            process.chdir(path.dirname(__filename));
+        });
+
+        this.tearDown(function() {
+            process.chdir(this.cwd);
+        });
+
+        // readAllModulesParallel only runs asynchronously, so compare
+        // what the command line writes with and without workers.
+        this.combineWith = function (jobs, root) {
+            return child_process.execFileSync(
+                process.execPath,
+                [require.resolve('../bin/combine.js'), '--jobs', String(jobs), path.normalize(root)],
+                {encoding: 'utf-8'});
+        };
+
+        test('workers read the same modules as readAllModules', function () {
+            var self = this;
+            ['combine/d.js', 'combine/custom-loaders/relative.js', 'combine/deferred-alias/double_double.js'].forEach(function (root) {
+                assert.equal(self.combineWith(1, root), self.combineWith(2, root));
+            });
+        });
+
+        test('regular expressions keep all their flags through a worker', function () {
+            var combined = this.combineWith(2, 'combine/regexp.js');
+            assert.equal(this.combineWith(1, 'combine/regexp.js'), combined);
+            assert.notEqual(-1, combined.indexOf('/a+/gim'));
+            assert.notEqual(-1, combined.indexOf('/a+/y'));
+            assert.notEqual(-1, combined.indexOf('/\\u{1F600}/u'));
+        });
+    });
+
+    fixture('unused imports', function () {
+        this.setUp(function() {
+            this.cwd = process.cwd();
+            process.chdir(path.dirname(__filename));
+            this.root = path.normalize('combine/unused/root.js');
+            this.modules = combine.readModules(this.root);
+        });
+
+        this.tearDown(function() {
+            process.chdir(this.cwd);
+        });
+
+        test('imports the body never refers to are unused', function () {
+            var modules = this.modules.resolved;
+            assert.deepEqual(['unused'], combine.findUnusedImports(modules[this.root]));
+            assert.deepEqual(['shared'], combine.findUnusedImports(modules[path.normalize('combine/unused/used.js')]));
+        });
+
+        test('any other use of imports uses everything', function () {
+            var escapes = path.normalize('combine/unused/escapes.js');
+            var modules = combine.readModules(escapes).resolved;
+            assert.deepEqual([], combine.findUnusedImports(modules[escapes]));
+        });
+
+        test('dropping unused imports leaves out modules nothing else needs', function () {
+            var dropped = combine.dropUnusedImports(this.modules, [this.root]);
+            assert.deepEqual([path.normalize('combine/unused/unused.js')], dropped);
+            assert.deepEqual(
+                ['combine/unused/quoted.js', 'combine/unused/root.js', 'combine/unused/used.js'].map(path.normalize),
+                Object.keys(this.modules.resolved).sort());
+            assert.equal(-1, combine.gen_code(combine.combine(this.modules, this.root)).indexOf("'unused'"));
+        });
+
+        test('the size report lists importers and unused imports', function () {
+            var report = combine.sizeReport(this.modules, [this.root]);
+            var unused = report.modules[path.normalize('combine/unused/unused.js')];
+            assert.deepEqual(
+                ['combine/unused/root.js', 'combine/unused/used.js'].map(path.normalize),
+                unused.importedBy);
+            assert.deepEqual(['unused'], report.modules[this.root].unusedImports);
+            assert.true(unused.minified < unused.raw);
+            assert.equal(
+                report.total.raw,
+                Object.keys(report.modules).reduce(function (total, name) {
+                    return total + report.modules[name].raw;
+                }, 0));
+        });
+    });
 });
+
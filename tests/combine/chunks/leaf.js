@@ -0,0 +1,4 @@
+module({
+}, function(imports) {
+    return leaf_export_table;
+});
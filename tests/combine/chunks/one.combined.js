@@ -0,0 +1,6 @@
+module({
+    "shared.combined.js": "shared.combined.js"
+}, function($module$deferred) {
+    var $module$chunk = $module$deferred["shared.combined.js"];
+    return $module$chunk["combine/chunks/one.js"]();
+});
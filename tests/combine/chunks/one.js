@@ -0,0 +1,6 @@
+module({
+    shared: 'shared.js',
+    onlyOne: 'only-one.js'
+}, function(imports) {
+    return one_export_table;
+});
@@ -0,0 +1,5 @@
+module({
+    leaf: 'leaf.js'
+}, function(imports) {
+    return only_one_export_table;
+});
@@ -0,0 +1,48 @@
+module({
+    "action!/combine/chunks/leaf.js": "action!/combine/chunks/leaf.js"
+}, function($module$deferred) {
+    function $module$once(f) {
+        var done = false, exports;
+        return function() {
+            if (!done) {
+                exports = f();
+                done = true;
+            }
+            return exports;
+        };
+    }
+    var $module$1 = $module$once(function() {
+        return function(imports) {
+            return leaf_export_table;
+        }({});
+    });
+    var $module$2 = $module$once(function() {
+        return function(imports) {
+            return shared_export_table;
+        }({
+            leaf: $module$1(),
+            loader: $module$deferred["action!/combine/chunks/leaf.js"]
+        });
+    });
+    var $module$3 = $module$once(function() {
+        return function(imports) {
+            return only_one_export_table;
+        }({
+            leaf: $module$1()
+        });
+    });
+    var $module$4 = $module$once(function() {
+        return function(imports) {
+            return one_export_table;
+        }({
+            shared: $module$2(),
+            onlyOne: $module$3()
+        });
+    });
+    return {
+        "combine/chunks/one.js": $module$4,
+        "combine/chunks/shared.js": $module$2,
+        "combine/chunks/leaf.js": $module$1,
+        "combine/chunks/only-one.js": $module$3
+    };
+});
@@ -0,0 +1,6 @@
+module({
+    leaf: 'leaf.js',
+    loader: 'action!leaf.js'
+}, function(imports) {
+    return shared_export_table;
+});
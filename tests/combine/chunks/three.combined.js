@@ -0,0 +1,9 @@
+module({
+    "shared.combined.js": "shared.combined.js"
+}, function($module$deferred) {
+    var $module$chunk = $module$deferred["shared.combined.js"];
+    var imports = {
+        onlyOne: $module$chunk["combine/chunks/only-one.js"]()
+    };
+    return three_export_table;
+});
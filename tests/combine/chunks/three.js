@@ -0,0 +1,5 @@
+module({
+    onlyOne: 'only-one.js'
+}, function(imports) {
+    return three_export_table;
+});
@@ -0,0 +1,12 @@
+module({
+    "shared.combined.js": "shared.combined.js",
+    "@alias": "@alias"
+}, function($module$deferred) {
+    var $module$chunk = $module$deferred["shared.combined.js"];
+    var imports = {
+        shared: $module$chunk["combine/chunks/shared.js"](),
+        one: $module$chunk["combine/chunks/one.js"](),
+        alias: $module$deferred["@alias"]
+    };
+    return two_export_table;
+});
@@ -0,0 +1,7 @@
+module({
+    shared: 'shared.js',
+    one: 'one.js',
+    alias: '@alias'
+}, function(imports) {
+    return two_export_table;
+});
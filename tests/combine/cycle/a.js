@@ -0,0 +1,5 @@
+module({
+    b: 'b.js'
+}, function(imports) {
+    return {};
+});
@@ -0,0 +1,5 @@
+module({
+    a: 'a.js'
+}, function(imports) {
+    return {};
+});
@@ -0,0 +1,7 @@
+module({}, function () {
+    return {
+        global: /a+/gim,
+        sticky: /a+/y,
+        unicode: /\u{1F600}/u
+    };
+});
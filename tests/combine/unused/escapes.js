@@ -0,0 +1,6 @@
+module({
+    used: './used.js',
+    unused: './unused.js'
+}, function(imports) {
+    return _.keys(imports);
+});
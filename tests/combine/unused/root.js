@@ -0,0 +1,7 @@
+module({
+    used: './used.js',
+    unused: './unused.js',
+    quoted: './quoted.js'
+}, function(imports) {
+    return imports.used + imports['quoted'];
+});
@@ -0,0 +1,5 @@
+module({
+    shared: './unused.js'
+}, function(imports) {
+    return 'used';
+});
@@ -0,0 +1,45 @@
+module({}, function(imports) {
+    var path = require('path');
+    var selectTests = require('../bin/select-tests.js');
+
+    // d.js -> subdir/b.js -> a.js -> e.js
+    //      -> c.js ------> a.js
+    var D = 'tests/combine/d.js';
+    var C = 'tests/combine/c.js';
+
+    fixture('select-tests', function() {
+        this.setUp(function() {
+            this.cwd = process.cwd();
+            process.chdir(path.resolve(path.dirname(__filename), '..'));
+            this.graph = new selectTests.DependencyGraph(null);
+        });
+
+        this.tearDown(function() {
+            process.chdir(this.cwd);
+        });
+
+        test('selects tests that transitively import a changed file', function() {
+            assert.deepEqual([D, C], selectTests.selectTests(this.graph, [D, C], ['tests/combine/e.js'], null));
+        });
+
+        test('skips tests that do not import the changed file', function() {
+            assert.deepEqual([D], selectTests.selectTests(this.graph, [D, C], ['tests/combine/subdir/b.js'], null));
+        });
+
+        test('a changed test selects itself', function() {
+            assert.deepEqual([D], selectTests.selectTests(this.graph, [D, C], [D], null));
+        });
+
+        test('documentation changes select nothing', function() {
+            assert.deepEqual([], selectTests.selectTests(this.graph, [D, C], ['README.md'], null));
+        });
+
+        test('files outside the module graph select everything', function() {
+            assert.deepEqual([D, C], selectTests.selectTests(this.graph, [D, C], ['SConstruct'], null));
+        });
+
+        test('anything the superfixture imports selects everything', function() {
+            assert.deepEqual([D, C], selectTests.selectTests(this.graph, [D, C], ['tests/combine/e.js'], 'tests/combine/subdir/b.js'));
+        });
+    });
+});
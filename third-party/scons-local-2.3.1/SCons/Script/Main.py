@@ -68,6 +68,7 @@ import SCons.Util
 import SCons.Warnings
 
 import SCons.Script.Interactive
+import SCons.Script.Watch
 
 def fetch_win32_parallel_msg():
     # A subsidiary function that exists solely to isolate this import
@@ -1078,6 +1079,11 @@ def _main(parser):
         SCons.Script.Interactive.interact(fs, OptionsParser, options,
                                           targets, target_top)
 
+    elif options.watch:
+        SCons.Node.interactive = True
+        SCons.Script.Watch.watch(fs, OptionsParser, options,
+                                 targets, target_top)
+
     else:
 
         # Build the targets
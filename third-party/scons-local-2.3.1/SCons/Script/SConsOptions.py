@@ -789,6 +789,11 @@ def Parser(version):
                   action="store_true",
                   help="Run in interactive mode.")
 
+    op.add_option('--watch',
+                  dest='watch', default=False,
+                  action="store_true",
+                  help="Build, then rebuild whenever a source file changes.")
+
     op.add_option('-j', '--jobs',
                   nargs=1, type="int",
                   dest="num_jobs", default=1,
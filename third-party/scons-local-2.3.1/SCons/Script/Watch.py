@@ -0,0 +1,240 @@
+#
+# Copyright (c) 2001, 2002, 2003, 2004, 2005, 2006, 2007, 2008, 2009, 2010, 2011, 2012, 2013, 2014 The SCons Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+__doc__ = """
+SCons watch mode (IMVU local addition)
+
+Builds the requested targets, then keeps the DAG in memory and rebuilds
+as soon as a source file changes.  Unlike --interactive, which walks and
+clears every node before each build, only the changed nodes and their
+transitive dependents are reset; everything else keeps its up-to-date
+state, so the Taskmaster skips it without re-evaluating signatures.
+"""
+
+import copy
+import os
+import select
+import struct
+import sys
+import time
+
+import SCons.Node
+import SCons.Node.FS
+
+# After the first change event, keep collecting events for this long so a
+# multi-file save (or an editor's write-rename dance) produces one build.
+DEBOUNCE_SECONDS = 0.05
+
+POLL_INTERVAL_SECONDS = 0.25
+
+class PollingWatcher(object):
+    """Portable fallback that stats every watched file periodically."""
+
+    def __init__(self, interval=POLL_INTERVAL_SECONDS):
+        self.interval = interval
+        self.signatures = {}
+
+    def _signature(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+
+    def watch(self, paths):
+        for path in paths:
+            if path not in self.signatures:
+                self.signatures[path] = self._signature(path)
+
+    def wait(self):
+        while True:
+            time.sleep(self.interval)
+            changed = []
+            for path, signature in self.signatures.items():
+                current = self._signature(path)
+                if current != signature:
+                    self.signatures[path] = current
+                    changed.append(path)
+            if changed:
+                return changed
+
+class InotifyWatcher(object):
+    """Watches the directories containing the watched files with Linux
+    inotify, so an idle watcher costs nothing and changes are seen
+    immediately."""
+
+    IN_MODIFY      = 0x00000002
+    IN_ATTRIB      = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM  = 0x00000040
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_DELETE      = 0x00000200
+
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+            IN_MOVED_TO | IN_CREATE | IN_DELETE)
+
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        self.directories = {} # wd : directory
+        self.watched = set()
+
+    def watch(self, paths):
+        for directory in set(os.path.dirname(path) for path in paths):
+            if directory in self.watched:
+                continue
+            wd = self.libc.inotify_add_watch(self.fd, directory, self.MASK)
+            if wd >= 0:
+                self.directories[wd] = directory
+                self.watched.add(directory)
+
+    def wait(self):
+        changed = set()
+        while True:
+            timeout = DEBOUNCE_SECONDS if changed else None
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if not ready:
+                return sorted(changed)
+            buf = os.read(self.fd, 65536)
+            offset = 0
+            while offset < len(buf):
+                wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(buf, offset)
+                offset += self.EVENT_HEADER.size
+                name = buf[offset:offset + length].rstrip('\0')
+                offset += length
+                directory = self.directories.get(wd)
+                if directory is not None and name:
+                    changed.add(os.path.join(directory, name))
+
+def create_watcher():
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher()
+
+class BuildGraph(object):
+    """In-memory reverse dependency index over the nodes reachable from
+    the build targets."""
+
+    def __init__(self):
+        self.children = {} # node : [child nodes]
+        self.parents = {}  # node : set of parent nodes
+        self.sources = {}  # abspath : source File node
+
+    def add(self, roots):
+        stack = list(roots)
+        while stack:
+            node = stack.pop()
+            if node in self.children:
+                continue
+            children = node.children(scan=1)
+            self.children[node] = children
+            for child in children:
+                self.parents.setdefault(child, set()).add(node)
+                stack.append(child)
+            if isinstance(node, SCons.Node.FS.File) and not node.has_builder():
+                self.sources[node.abspath] = node
+
+    def source_paths(self):
+        return self.sources.keys()
+
+    def lookup(self, paths):
+        return [self.sources[path] for path in paths if path in self.sources]
+
+    def affected(self, changed):
+        """Returns the changed nodes, anything that failed last time, and
+        everything that transitively depends on them."""
+        stack = list(changed)
+        stack.extend(
+            node for node in self.children
+            if node.get_state() == SCons.Node.failed)
+        result = set()
+        while stack:
+            node = stack.pop()
+            if node in result:
+                continue
+            result.add(node)
+            stack.extend(self.parents.get(node, ()))
+        return result
+
+    def reset(self, nodes):
+        for node in nodes:
+            node.clear()
+            # node.clear() doesn't reset node.state, so call
+            # node.set_state() to reset it manually
+            node.set_state(SCons.Node.no_state)
+            node.implicit = None
+
+            # Affected nodes are rescanned after the build, so forget the
+            # edges they contributed; their children may have changed.
+            for child in self.children.pop(node, ()):
+                self.parents[child].discard(node)
+
+def watch(fs, parser, options, targets, target_top):
+    import SCons.Script.Main
+
+    def build():
+        return SCons.Script.Main._build_targets(
+            fs, copy.deepcopy(options), targets, target_top)
+
+    nodes = build()
+    if not nodes:
+        return
+
+    graph = BuildGraph()
+    graph.add(nodes)
+
+    watcher = create_watcher()
+    watcher.watch(graph.source_paths())
+
+    while True:
+        SCons.Script.Main.progress_display("scons: Watching %d files for changes ..." % len(graph.sources))
+        changed = graph.lookup(watcher.wait())
+        if not changed:
+            continue
+
+        start = time.time()
+        for node in changed:
+            SCons.Script.Main.progress_display("scons: `%s' changed" % node)
+
+        affected = graph.affected(changed)
+        graph.reset(affected)
+        build()
+        graph.add(affected)
+        watcher.watch(graph.source_paths())
+
+        SCons.Script.Main.progress_display("scons: Rebuilt in %.3f seconds." % (time.time() - start))
+
+# Local Variables:
+# tab-width:4
+# indent-tabs-mode:nil
+# End:
+# vim: set expandtab tabstop=4 shiftwidth=4:
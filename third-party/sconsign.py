@@ -172,6 +172,7 @@ sys.path = libs + sys.path
 import SCons.compat   # so pickle will import cPickle instead
 
 import whichdb
+import json
 import time
 import pickle
 import imp
@@ -213,7 +214,10 @@ class Flagger(object):
 Do_Call = None
 Print_Directories = []
 Print_Entries = []
+Lookup_Entries = []
 Print_Flags = Flagger()
+Print_Json = 0
+Diff = 0
 Verbose = 0
 Readable = 0
 
@@ -306,6 +310,59 @@ def nodeinfo_cooked(name, ninfo, prefix=""):
 
 nodeinfo_string = nodeinfo_cooked
 
+def nodeinfo_dict(ninfo):
+    d = ninfo.__dict__
+    try:
+        keys = ninfo.field_list
+    except AttributeError:
+        keys = sorted(d.keys())
+    return dict((k, d[k]) for k in keys if k in d)
+
+def entry_record(name, entry):
+    """Returns the JSON-friendly form of a single .sconsign entry,
+    including the signatures of every dependency it was built from."""
+    record = {}
+    try:
+        record.update(nodeinfo_dict(entry.ninfo))
+    except AttributeError:
+        pass
+    try:
+        binfo = entry.binfo
+    except AttributeError:
+        return record
+    action = map_action(binfo, 'action')
+    if action is not None:
+        record['action'] = action
+    try:
+        bkids = binfo.bsources + binfo.bdepends + binfo.bimplicit
+        bkidsigs = binfo.bsourcesigs + binfo.bdependsigs + binfo.bimplicitsigs
+    except AttributeError:
+        pass
+    else:
+        record['dependencies'] = dict(
+            (str(kid), nodeinfo_dict(sig)) for kid, sig in zip(bkids, bkidsigs))
+    return record
+
+def print_json(record):
+    # One object per line, so huge databases stream instead of being
+    # accumulated into a single document.
+    print json.dumps(record, sort_keys=True, default=str)
+
+def printentry(name, entry, location):
+    if Print_Json:
+        record = entry_record(name, entry)
+        record['dir'] = location
+        record['entry'] = name
+        print_json(record)
+        return
+    try:
+        ninfo = entry.ninfo
+    except AttributeError:
+        print name + ":"
+    else:
+        print nodeinfo_string(name, entry.ninfo)
+    printfield(name, entry.binfo)
+
 def printfield(name, entry, prefix=""):
     outlist = field("implicit", entry, 0)
     if outlist:
@@ -327,23 +384,46 @@ def printentries(entries, location):
             except KeyError:
                 sys.stderr.write("sconsign: no entry `%s' in `%s'\n" % (name, location))
             else:
-                try:
-                    ninfo = entry.ninfo
-                except AttributeError:
-                    print name + ":"
-                else:
-                    print nodeinfo_string(name, entry.ninfo)
-                printfield(name, entry.binfo)
+                printentry(name, entry, location)
     else:
         for name in sorted(entries.keys()):
-            entry = entries[name]
-            try:
-                ninfo = entry.ninfo
-            except AttributeError:
-                print name + ":"
-            else:
-                print nodeinfo_string(name, entry.ninfo)
-            printfield(name, entry.binfo)
+            printentry(name, entries[name], location)
+
+def lookupentry(entries, name, dir):
+    try:
+        entry = entries[name]
+    except KeyError:
+        sys.stderr.write("sconsign: no entry `%s' in `%s'\n" % (name, dir))
+    else:
+        printentry(name, entry, dir)
+
+def diffentries(dir, old_entries, new_entries):
+    for name in sorted(set(old_entries) | set(new_entries)):
+        if name not in new_entries:
+            change, fields = 'removed', []
+        elif name not in old_entries:
+            change, fields = 'added', []
+        else:
+            old = entry_record(name, old_entries[name])
+            new = entry_record(name, new_entries[name])
+            fields = sorted(k for k in set(old) | set(new) if old.get(k) != new.get(k))
+            if not fields:
+                continue
+            change = 'changed'
+            if 'dependencies' in fields:
+                old_deps = old.get('dependencies', {})
+                new_deps = new.get('dependencies', {})
+                fields.remove('dependencies')
+                fields.extend(
+                    'dependency ' + dep
+                    for dep in sorted(set(old_deps) | set(new_deps))
+                    if old_deps.get(dep) != new_deps.get(dep))
+        if Print_Json:
+            print_json({'dir': dir, 'entry': name, 'change': change, 'fields': fields})
+        elif fields:
+            print '%s %s: %s' % (change, os.path.join(dir, name), ', '.join(fields))
+        else:
+            print '%s %s' % (change, os.path.join(dir, name))
 
 class Do_SConsignDB(object):
     def __init__(self, dbm_name, dbm):
@@ -351,6 +431,55 @@ class Do_SConsignDB(object):
         self.dbm = dbm
 
     def __call__(self, fname):
+        db = self.open(fname)
+        if db is None:
+            return
+
+        if Lookup_Entries:
+            # Only unpickle the directories that hold the requested
+            # entries; the rest of the database is never decoded.
+            loaded = {}
+            for dir, name in Lookup_Entries:
+                if dir not in loaded:
+                    try:
+                        loaded[dir] = pickle.loads(db[dir])
+                    except KeyError:
+                        sys.stderr.write("sconsign: no dir `%s' in `%s'\n" % (dir, fname))
+                        loaded[dir] = None
+                if loaded[dir] is not None:
+                    lookupentry(loaded[dir], name, dir)
+        elif Print_Directories:
+            for dir in Print_Directories:
+                try:
+                    val = db[dir]
+                except KeyError:
+                    sys.stderr.write("sconsign: no dir `%s' in `%s'\n" % (dir, args[0]))
+                else:
+                    self.printentries(dir, val)
+        else:
+            for dir in sorted(db.keys()):
+                self.printentries(dir, db[dir])
+
+    def diff(self, old_fname, new_fname):
+        old_db = self.open(old_fname)
+        new_db = self.open(new_fname)
+        if old_db is None or new_db is None:
+            return
+        for dir in sorted(set(old_db.keys()) | set(new_db.keys())):
+            if Print_Directories and dir not in Print_Directories:
+                continue
+            old_val = old_db[dir] if dir in old_db else None
+            new_val = new_db[dir] if dir in new_db else None
+            # Directories are stored as individual pickles, so unchanged
+            # ones can be skipped without decoding them.
+            if old_val == new_val:
+                continue
+            diffentries(
+                dir,
+                pickle.loads(old_val) if old_val is not None else {},
+                pickle.loads(new_val) if new_val is not None else {})
+
+    def open(self, fname):
         # The *dbm modules stick their own file suffixes on the names
         # that are passed in.  This is causes us to jump through some
         # hoops here to be able to allow the user
@@ -380,30 +509,20 @@ class Do_SConsignDB(object):
                     # fact back.
                     print_e = e
                 sys.stderr.write("sconsign: %s\n" % (print_e))
-                return
+                return None
         except KeyboardInterrupt:
             raise
         except pickle.UnpicklingError:
             sys.stderr.write("sconsign: ignoring invalid `%s' file `%s'\n" % (self.dbm_name, fname))
-            return
+            return None
         except Exception, e:
             sys.stderr.write("sconsign: ignoring invalid `%s' file `%s': %s\n" % (self.dbm_name, fname, e))
-            return
-
-        if Print_Directories:
-            for dir in Print_Directories:
-                try:
-                    val = db[dir]
-                except KeyError:
-                    sys.stderr.write("sconsign: no dir `%s' in `%s'\n" % (dir, args[0]))
-                else:
-                    self.printentries(dir, val)
-        else:
-            for dir in sorted(db.keys()):
-                self.printentries(dir, db[dir])
+            return None
+        return db
 
     def printentries(self, dir, val):
-        print '=== ' + dir + ':'
+        if not Print_Json:
+            print '=== ' + dir + ':'
         printentries(pickle.loads(val), dir)
 
 def Do_SConsignDir(name):
@@ -422,7 +541,17 @@ def Do_SConsignDir(name):
     except Exception, e:
         sys.stderr.write("sconsign: ignoring invalid .sconsign file `%s': %s\n" % (name, e))
         return
-    printentries(sconsign.entries, args[0])
+    if Lookup_Entries:
+        # A per-directory file only holds the entries of the directory
+        # it's in.
+        location = os.path.normpath(os.path.dirname(name))
+        for dir, entry_name in Lookup_Entries:
+            if os.path.normpath(dir) != location:
+                sys.stderr.write("sconsign: no dir `%s' in `%s'\n" % (dir, name))
+            else:
+                lookupentry(sconsign.entries, entry_name, dir)
+    else:
+        printentries(sconsign.entries, args[0])
 
 ##############################################################################
 
@@ -434,10 +563,18 @@ Options:
   -a, --act, --action         Print build action information.
   -c, --csig                  Print content signature information.
   -d DIR, --dir=DIR           Print only info about DIR.
-  -e ENTRY, --entry=ENTRY     Print only info about ENTRY.
+  --diff                      Print the entries that differ between two
+                              database FILEs (old, then new).
+  -e ENTRY, --entry=ENTRY     Print only info about ENTRY.  A DIR/NAME
+                              path looks up that single entry; in a
+                              database, without decoding the rest of it,
+                              and in a per-directory .sconsign file, only
+                              if the file is in DIR.
   -f FORMAT, --format=FORMAT  FILE is in the specified FORMAT.
   -h, --help                  Print this message and exit.
   -i, --implicit              Print implicit dependency information.
+  --json                      Print one JSON object per entry, including
+                              every dependency's signature.
   -r, --readable              Print timestamps in human-readable form.
   --raw                       Print raw Python object representations.
   -s, --size                  Print file sizes.
@@ -447,8 +584,8 @@ Options:
 
 opts, args = getopt.getopt(sys.argv[1:], "acd:e:f:hirstv",
                             ['act', 'action',
-                             'csig', 'dir=', 'entry=',
-                             'format=', 'help', 'implicit',
+                             'csig', 'diff', 'dir=', 'entry=',
+                             'format=', 'help', 'implicit', 'json',
                              'raw', 'readable',
                              'size', 'timestamp', 'verbose'])
 
@@ -460,8 +597,13 @@ for o, a in opts:
         Print_Flags['csig'] = 1
     elif o in ('-d', '--dir'):
         Print_Directories.append(a)
+    elif o in ('--diff',):
+        Diff = 1
     elif o in ('-e', '--entry'):
-        Print_Entries.append(a)
+        if '/' in a:
+            Lookup_Entries.append(tuple(a.rsplit('/', 1)))
+        else:
+            Print_Entries.append(a)
     elif o in ('-f', '--format'):
         Module_Map = {'dblite'   : 'SCons.dblite',
                       'sconsign' : None}
@@ -481,6 +623,8 @@ for o, a in opts:
         sys.exit(0)
     elif o in ('-i', '--implicit'):
         Print_Flags['implicit'] = 1
+    elif o in ('--json',):
+        Print_Json = 1
     elif o in ('--raw',):
         nodeinfo_string = nodeinfo_raw
     elif o in ('-r', '--readable'):
@@ -492,7 +636,21 @@ for o, a in opts:
     elif o in ('-v', '--verbose'):
         Verbose = 1
 
-if Do_Call:
+if Diff:
+    if len(args) != 2:
+        sys.stderr.write("sconsign: --diff needs exactly two database files\n")
+        sys.exit(2)
+    if isinstance(Do_Call, Do_SConsignDB):
+        Do_Call.diff(*args)
+    else:
+        dbm_name = whichdb.whichdb(args[0])
+        if not dbm_name:
+            sys.stderr.write("sconsign: --diff only supports database files\n")
+            sys.exit(2)
+        Map_Module = {'SCons.dblite' : 'dblite'}
+        dbm = my_import(dbm_name)
+        Do_SConsignDB(Map_Module.get(dbm_name, dbm_name), dbm).diff(*args)
+elif Do_Call:
     for a in args:
         Do_Call(a)
 else: